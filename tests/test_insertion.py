@@ -0,0 +1,20 @@
+import pytest
+from utils.distances import VEHICLE_SPEED, scenario_matrices
+from utils.evaluate import PlanEvaluator
+from utils.insertion import _insert
+from utils.utils import random_scenario
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("regret", [False, True])
+def test_loss_matches_evaluator(seed, regret):
+    # the loss is in meters, the cumulative score in whole seconds per leg
+    scenario = random_scenario(5, 20, seed)
+    vehicles, customers = scenario["vehicles"], scenario["customers"]
+    matrices = scenario_matrices(vehicles, customers, dropoff_pickup=False)
+
+    starts, connections, loss = _insert(vehicles, customers, matrices, regret)
+    score = PlanEvaluator(vehicles, customers).score(starts, connections)
+
+    assert len(starts) + len(connections) == len(customers)
+    assert loss / VEHICLE_SPEED == pytest.approx(score, rel=1e-2)
@@ -0,0 +1,36 @@
+import pytest
+from utils.insertion import insertion_plan
+from utils.local_search import LocalSearch
+from utils.utils import random_scenario
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_move_deltas_match_full_evaluation(seed):
+    scenario = random_scenario(4, 30, seed)
+    vehicles, customers = scenario["vehicles"], scenario["customers"]
+    search = LocalSearch(vehicles, customers)
+    # no budget, only sets up the chains
+    search.improve(*insertion_plan(vehicles, customers, regret=False), time_budget=0)
+
+    for c in range(len(customers)):
+        for delta, kind, route, q in list(search._moves(c)):
+            chains = [list(r.customers) for r in search.routes]
+            before = search.loss()
+            search._apply(c, kind, route, q)
+            assert search.loss() - before == pytest.approx(delta, rel=1e-9, abs=1e-3)
+
+            for r, chain in zip(search.routes, chains):
+                search._set(r, chain)
+
+
+def test_cycle_in_connections_places_every_customer_once():
+    scenario = random_scenario(2, 4, 0)
+    vehicles, customers = scenario["vehicles"], scenario["customers"]
+    ids = [c["id"] for c in customers]
+    starts = [(vehicles[0]["id"], ids[0]), (vehicles[1]["id"], ids[2])]
+    connections = [(ids[0], ids[1]), (ids[1], ids[0]), (ids[2], ids[3]), (ids[3], ids[1])]
+
+    starts, connections = LocalSearch(vehicles, customers).improve(starts, connections, time_budget=0)
+
+    served = [c for _, c in starts] + [c for _, c in connections]
+    assert sorted(served) == sorted(ids)
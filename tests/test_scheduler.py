@@ -0,0 +1,43 @@
+import time
+import pyomo.environ as pyo
+import pytest
+from utils.scheduler import schedule, schedule_within
+from utils.utils import random_scenario
+
+BUDGET_TOLERANCE = 0.25  # seconds, the insertion plan and HighsScheduler's INTERRUPT_LATENCY
+
+
+def test_schedule_within_beats_fallback():
+    # most insertion arcs are outside the radius and added as one-way arcs, they must not chain for free
+    scenario = random_scenario(2, 8, 0)
+    incumbents = []
+    result = schedule_within(scenario["vehicles"], scenario["customers"], 1000, pyo.SolverFactory("appsi_highs"), 3.0,
+                             on_incumbent=lambda plan: incumbents.append(plan["score"]))
+
+    assert len(incumbents) > 1
+    assert result["score"] == incumbents[-1] < incumbents[0]
+
+
+def test_schedule_within_keeps_budget():
+    # large enough that HiGHS is still in its root node at the deadline
+    scenario = random_scenario(25, 500, 0)
+    start = time.perf_counter()
+    result = schedule_within(scenario["vehicles"], scenario["customers"], 100, pyo.SolverFactory("appsi_highs"), 1.0)
+    elapsed = time.perf_counter() - start
+
+    if result["model"] is not None:
+        result["model"].wait()
+    assert elapsed <= 1.0 + BUDGET_TOLERANCE
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_highs_backend_matches_pyomo(seed):
+    scenario = random_scenario(3, 12, seed)
+    objectives = {}
+    for backend in ("highs", "pyomo"):
+        model, _, _, _ = schedule(scenario["vehicles"], scenario["customers"], 1000, pyo.SolverFactory("appsi_highs"),
+                                  backend=backend)
+        objectives[backend] = model.objective() if backend == "highs" else pyo.value(model.loss)
+
+    # both solve to HiGHS's default relative gap
+    assert objectives["highs"] == pytest.approx(objectives["pyomo"], rel=1e-3)
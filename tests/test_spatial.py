@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from utils.distances import haversine_matrix
+from utils.spatial import GridIndex, nearest_pairs, radius_pairs
+
+
+def brute_pairs(src, dst, radius):
+    matrix = haversine_matrix(src, dst)
+    rows, cols = np.nonzero(matrix < radius)
+    return set(zip(rows.tolist(), cols.tolist()))
+
+
+@pytest.mark.parametrize("radius", [500.0, 5000.0, 50000.0])
+def test_radius_pairs_over_wide_latitude_span(radius):
+    # far from the mean latitude the projection overstates east-west distances by much more than 1 %
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(0.0, 70.0, 3000)
+    lons = rng.uniform(0.0, 0.5, 3000)
+    dst = np.stack([lats, lons], axis=1)
+    src = dst + rng.normal(0.0, radius / 2e5, dst.shape)
+
+    rows, cols, _ = radius_pairs(src, dst, radius)
+
+    assert set(zip(rows.tolist(), cols.tolist())) == brute_pairs(src, dst, radius)
+
+
+def test_index_answers_other_radii():
+    rng = np.random.default_rng(1)
+    dst = rng.uniform((50.0, 8.0), (52.0, 10.0), (2000, 2))
+    src = rng.uniform((49.0, 7.0), (53.0, 11.0), (200, 2))
+    index = GridIndex(dst, 1000.0)
+
+    for radius in (300.0, 1000.0, 7000.0):
+        rows, cols, _ = index.query(src, radius)
+        assert set(zip(rows.tolist(), cols.tolist())) == brute_pairs(src, dst, radius)
+
+    rows, cols, dists = nearest_pairs(src, dst, 1000.0, index)
+    assert np.array_equal(cols[np.argsort(rows)], haversine_matrix(src, dst).argmin(axis=1))
@@ -0,0 +1,153 @@
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pyomo.environ as pyo
+from utils.client import ScenarioClient
+from utils.distances import scenario_matrices
+from utils.evaluate import PlanEvaluator
+from utils.insertion import insertion_plan
+from utils.online import queue_plan
+from utils.scheduler import calculate_score, customer_distances, schedule
+from utils.simulator import Simulator
+from utils.utils import pool_context, randomized_payload, update_scenario, update_scenario_dist
+
+# Suppress Pyomo logging
+logging.getLogger('pyomo').setLevel(logging.ERROR)
+
+POLICIES = ("optimized", "insertion", "random")
+
+_client = None
+
+
+def _worker_client():
+    # one keep-alive client per worker process
+    global _client
+    if _client is None:
+        _client = ScenarioClient()
+    return _client
+
+
+def run_scenario(policy, run, seed, amount_v, amount_c, speed, radius, formulation, backend, threads,
+                 vehicle_radius=None, simulate=False):
+    """
+    Create, plan, launch and simulate one scenario, like a single collect_data iteration.
+
+    :param policy: "optimized" plans with schedule, "insertion" with insertion_plan, "random" with
+        randomized_payload
+    :param seed: seeds randomized_payload, and the scenario when simulated
+    :param threads: HiGHS threads for this run
+    :param simulate: run on a Simulator instead of the scenario services
+    :return: dict with the run's settings, "score" (calculate_score of the simulation, which only counts
+        the leg from the assignment to the pickup), "cumulative_score" (PlanEvaluator on the plan, the waits
+        from the start of the run) and per-phase timings in seconds
+    """
+    client = Simulator(seed) if simulate else _worker_client()
+    timings = {}
+
+    start = time.perf_counter()
+    scenario = client.create_scenario(amount_v, amount_c)
+    customers, vehicles = scenario["customers"], scenario["vehicles"]
+    timings["create"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrices = scenario_matrices(vehicles, customers, dropoff_pickup=False)
+    if policy == "optimized":
+        opt = pyo.SolverFactory('appsi_highs')
+        opt.options["threads"] = threads
+        _, starts, connections, _ = schedule(vehicles, customers, radius, opt, formulation, matrices=matrices,
+                                             backend=backend, vehicle_radius=vehicle_radius)
+    elif policy == "insertion":
+        starts, connections = insertion_plan(vehicles, customers, matrices)
+    else:
+        random.seed(seed)
+        payload = randomized_payload(vehicles, customers)
+        queues = {}
+        for entry in payload["vehicles"]:
+            queues.setdefault(entry["id"], []).append(entry["customerId"])
+        starts, connections = queue_plan(queues)
+    timings["plan"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    client.initialize_scenario(scenario)
+    client.launch_scenario(scenario["id"], speed)
+    timings["launch"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if policy != "random":
+        wait_times = update_scenario(starts, connections, scenario["id"], speed, client, verbose=False)
+    else:
+        wait_times = update_scenario_dist(payload, scenario["id"], speed, client, verbose=False)
+    timings["simulate"] = time.perf_counter() - start
+
+    return {
+        "policy": policy,
+        "run": run,
+        "seed": seed,
+        "scenario_id": scenario["id"],
+        "vehicles": amount_v,
+        "customers": amount_c,
+        "threads": threads,
+        "score": calculate_score(wait_times, customer_distances(customers, matrices)),
+        "cumulative_score": PlanEvaluator(vehicles, customers).score(starts, connections),
+        "timings": timings,
+    }
+
+
+def run_benchmark(policies=POLICIES, runs=20, amount_v=5, amount_c=10, workers=None, output="benchmark.jsonl",
+                  speed=0.0001, radius=100, formulation="cuts", backend="highs", seed=0, vehicle_radius=None,
+                  simulate=False):
+    """
+    Run every policy runs times on fresh scenarios, spread over a process pool.
+
+    HiGHS threads are split between the workers so they do not oversubscribe the cores. Each result is
+    appended to output as one JSON line as soon as its run finishes.
+
+    :param workers: processes, defaults to one per core but at most one per run
+    :param seed: run i of every policy uses seed + i
+    :return: the results, in the order they finished
+    """
+    jobs = [(policy, run, seed + run) for policy in policies for run in range(runs)]
+    workers = workers or min(os.cpu_count() or 1, len(jobs))
+    context, threads = pool_context(workers)
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool, open(output, "a") as f:
+        futures = [pool.submit(run_scenario, policy, run, run_seed, amount_v, amount_c, speed, radius, formulation,
+                               backend, threads, vehicle_radius, simulate) for policy, run, run_seed in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+            results.append(result)
+
+    elapsed = time.perf_counter() - start
+    for policy in policies:
+        scores = [r["score"] for r in results if r["policy"] == policy]
+        cumulative = [r["cumulative_score"] for r in results if r["policy"] == policy]
+        print(f"{policy}: {len(scores)} runs, average score {sum(scores) / len(scores)}, "
+              f"cumulative {sum(cumulative) / len(cumulative)}")
+    print(f"{len(results)} runs on {workers} workers with {threads} HiGHS threads each in {elapsed:.1f}s")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare dispatch policies on fresh scenarios in parallel.")
+    parser.add_argument("--policies", nargs="+", choices=POLICIES, default=list(POLICIES))
+    parser.add_argument("--runs", type=int, default=20, help="runs per policy")
+    parser.add_argument("--vehicles", type=int, default=5)
+    parser.add_argument("--customers", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default="benchmark.jsonl")
+    parser.add_argument("--speed", type=float, default=0.0001)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--simulate", action="store_true", help="use the in-process Simulator, no services needed")
+    args = parser.parse_args()
+
+    run_benchmark(args.policies, args.runs, args.vehicles, args.customers, args.workers, args.output, args.speed,
+                  seed=args.seed, simulate=args.simulate)
@@ -0,0 +1,123 @@
+import asyncio
+import bisect
+import threading
+import time
+from collections import defaultdict
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SCENARIO_URL = "http://localhost:8080"
+RUNNER_URL = "http://localhost:8090"
+
+# upper bounds of the latency histogram buckets in seconds, the last one catches everything slower
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, float("inf"))
+
+
+class WallClock:
+    """
+    Real time for the dispatch loops. The Simulator hands out virtual clocks with the same methods.
+    """
+
+    @staticmethod
+    def monotonic():
+        return time.monotonic()
+
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+
+    @staticmethod
+    async def wait(seconds):
+        await asyncio.sleep(seconds)
+
+
+class ScenarioClient:
+    """
+    One keep-alive session for the scenario service (8080) and the runner (8090).
+
+    Connections are pooled per host, failed connects (and for get_scenario 502/503/504 answers) are retried
+    with a short backoff, and every call has a timeout. The duration of each call is counted into a histogram per
+    endpoint, see latency_report. A client can be shared between threads.
+    """
+
+    def __init__(self, scenario_url=SCENARIO_URL, runner_url=RUNNER_URL, timeout=(3.05, 30), retries=3,
+                 pool_size=10):
+        self.scenario_url = scenario_url
+        self.runner_url = runner_url
+        self.timeout = timeout
+
+        # only GET is retried on read errors and 5xx answers, POST and PUT only when the connect failed: create
+        # never makes a second scenario and an update, e.g. launch or an assignment, is never sent twice
+        retry = Retry(total=retries, backoff_factor=0.05, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset({"GET"}))
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.histograms = defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+        self.totals = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def _request(self, endpoint, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            r = self.session.request(method, url, timeout=self.timeout, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.histograms[endpoint][bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+                self.totals[endpoint] += elapsed
+
+        r.raise_for_status()
+        return r
+
+    def create_scenario(self, amount_v, amount_c):
+        return self._request("create", "POST", f"{self.scenario_url}/scenario/create",
+                             params={"numberOfVehicles": amount_v, "numberOfCustomers": amount_c}).json()
+
+    def initialize_scenario(self, scenario):
+        return self._request("initialize", "POST", f"{self.runner_url}/Scenarios/initialize_scenario",
+                             json=scenario).json()
+
+    def launch_scenario(self, scenario_id, speed):
+        self._request("launch", "POST", f"{self.runner_url}/Runner/launch_scenario/{scenario_id}",
+                      params={"speed": speed})
+
+    def update_scenario(self, scenario_id, vehicles):
+        """
+        :param vehicles: list of {"id": vehicle id, "customerId": customer id}
+        :return: the runner's answer, with the assigned vehicles and their ETAs under "updatedVehicles"
+        """
+        return self._request("update", "PUT", f"{self.runner_url}/Scenarios/update_scenario/{scenario_id}",
+                             json={"vehicles": vehicles}).json()
+
+    def get_scenario(self, scenario_id):
+        return self._request("get", "GET", f"{self.runner_url}/Scenarios/get_scenario/{scenario_id}").json()
+
+    def clock(self, scenario_id):
+        # the services run in real time
+        return WallClock
+
+    def latency_report(self):
+        """
+        :return: dict endpoint -> {"count", "mean" (seconds), "buckets": {upper bound: calls}} with the
+            empty buckets left out
+        """
+        report = {}
+        with self._lock:
+            histograms = {endpoint: list(counts) for endpoint, counts in self.histograms.items()}
+
+        for endpoint, counts in histograms.items():
+            count = sum(counts)
+            report[endpoint] = {
+                "count": count,
+                "mean": self.totals[endpoint] / count,
+                "buckets": {bound: n for bound, n in zip(LATENCY_BUCKETS, counts) if n},
+            }
+
+        return report
+
+    def close(self):
+        self.session.close()
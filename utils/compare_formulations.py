@@ -0,0 +1,74 @@
+import sys
+import time
+import logging
+import pyomo.environ as pyo
+from utils.utils import random_scenario
+from utils.graph import CandidateGraph
+from utils.scheduler import FORMULATIONS, scenario_data, build_model, solve_with_cuts
+
+# Suppress Pyomo logging
+logging.getLogger('pyomo').setLevel(logging.ERROR)
+
+
+def lp_size(model):
+    rows = 0
+    nonzeros = 0
+    for con in model.component_data_objects(pyo.Constraint, active=True):
+        rows += 1
+        nonzeros += sum(1 for _ in pyo.expr.identify_variables(con.body))
+
+    cols = sum(1 for _ in model.component_data_objects(pyo.Var))
+    return rows, cols, nonzeros
+
+
+def compare(customer_counts=(10, 20, 50, 100), amount_v=5, radius=1000, time_limit=60, seed=0):
+    """
+    Build and solve the same random scenarios with every formulation.
+
+    Only the first solve is compared, without joker retries. "chain" charges the cumulative waiting time
+    along every arc, so long chains often cost more than a joker: its solves are much harder and leave more
+    customers to a joker, and every joker becomes an exception that schedule solves again with arcs from
+    every customer. On 3 vehicles and 10 customers at radius 1000 that is 8 exceptions and minutes of
+    retries where "cuts" takes a fraction of a second, which is why "cuts" is the default everywhere.
+
+    :return: one dict per (customers, formulation) with build/solve times in seconds and the LP size
+    """
+    results = []
+    for amount_c in customer_counts:
+        scenario = random_scenario(amount_v, amount_c, seed)
+
+        for formulation in FORMULATIONS:
+            start = time.time()
+            model = pyo.ConcreteModel(name="Scheduler")
+            graph = CandidateGraph(scenario["vehicles"], scenario["customers"], radius)
+            build_model(model, scenario_data(graph), formulation)
+            build_time = time.time() - start
+
+            rows, cols, nonzeros = lp_size(model)
+
+            opt = pyo.SolverFactory('appsi_highs')
+            opt.options["time_limit"] = time_limit
+
+            start = time.time()
+            solve_with_cuts(model, opt)
+            solve_time = time.time() - start
+
+            results.append({
+                "customers": amount_c,
+                "formulation": formulation,
+                "build": build_time,
+                "rows": rows,
+                "cols": cols,
+                "nonzeros": nonzeros,
+                "cuts": len(model.subset_elimination_constraints),
+                "solve": solve_time,
+                "loss": pyo.value(model.loss, exception=False),
+            })
+            print(results[-1])
+
+    return results
+
+
+if __name__ == "__main__":
+    counts = [int(x) for x in sys.argv[1:]] or [10, 20, 50, 100]
+    compare(counts)
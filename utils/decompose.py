@@ -0,0 +1,172 @@
+import math
+import os
+import time
+from multiprocessing import TimeoutError
+import numpy as np
+import pyomo.environ as pyo
+from utils.distances import coordinates, haversine_matrix
+from utils.insertion import insertion_plan
+from utils.local_search import LocalSearch
+from utils.scheduler import schedule, schedule_within
+from utils.spatial import METERS_PER_DEGREE
+from utils.utils import pool_context
+
+CLUSTER_SIZE = 20  # customers per cluster when the number of clusters is not given
+GRACE = 1.0  # seconds a cluster may overrun its share of the budget before insertion_plan replaces it
+
+
+def kmeans(points, k, seed=0, iterations=50):
+    """
+    Lloyd's k-means with k-means++ seeding.
+
+    :param points: (n, d) array, distances are Euclidean
+    :return: label of every point, (k, d) centers
+    """
+    rng = np.random.default_rng(seed)
+    centers = [points[rng.integers(len(points))]]
+    for _ in range(1, k):
+        d2 = ((points[:, None] - np.array(centers)[None]) ** 2).sum(axis=2).min(axis=1)
+        centers.append(points[rng.choice(len(points), p=d2 / d2.sum())] if d2.sum() else points[rng.integers(len(points))])
+    centers = np.array(centers)
+
+    labels = None
+    for _ in range(iterations):
+        new = ((points[:, None] - centers[None]) ** 2).sum(axis=2).argmin(axis=1)
+        if labels is not None and np.array_equal(new, labels):
+            break
+        labels = new
+        for j in range(k):
+            if np.any(labels == j):
+                centers[j] = points[labels == j].mean(axis=0)
+
+    return labels, centers
+
+
+def partition(vehicles, customers, k, seed=0):
+    """
+    Split a scenario into k geographic clusters.
+
+    Customers are clustered with kmeans on their pickup and dropoff, projected to meters. Every cluster
+    that got customers gets a share of the vehicles proportional to its customers, at least one, and the
+    vehicles go to the nearest cluster that still has room, judged by the mean pickup of the cluster.
+
+    :param k: at most the number of vehicles
+    :return: list of (vehicles, customers) per cluster, clusters without customers are left out
+    """
+    vehicle_coords, pickups, dropoffs = coordinates(vehicles, customers)
+    scale = np.array([METERS_PER_DEGREE, METERS_PER_DEGREE * math.cos(math.radians(pickups[:, 0].mean()))])
+    labels, _ = kmeans(np.hstack([pickups * scale, dropoffs * scale]), min(k, len(customers)), seed)
+
+    groups = [np.nonzero(labels == j)[0] for j in range(labels.max() + 1)]
+    groups = [g for g in groups if len(g)]
+    sizes = np.array([len(g) for g in groups])
+
+    # largest remainder, with one vehicle per cluster set aside first
+    spare = len(vehicles) - len(groups)
+    share = spare * sizes / sizes.sum()
+    quota = 1 + np.floor(share).astype(int)
+    quota[np.argsort(share - np.floor(share))[::-1][:spare - (quota - 1).sum()]] += 1
+
+    centers = np.array([pickups[g].mean(axis=0) for g in groups])
+    distances = haversine_matrix(vehicle_coords, centers)
+    members = [[] for _ in groups]
+    taken = set()
+    for flat in np.argsort(distances, axis=None):
+        v, j = divmod(int(flat), len(groups))
+        if v not in taken and len(members[j]) < quota[j]:
+            members[j].append(vehicles[v])
+            taken.add(v)
+
+    return [(members[j], [customers[i] for i in g]) for j, g in enumerate(groups)]
+
+
+def solve_cluster(vehicles, customers, radius, options, formulation, backend, time_budget, vehicle_radius=None):
+    """
+    Solve one cluster within time_budget, in a worker process.
+
+    The highs backend solves with schedule_within, which returns its best plan at the deadline. The pyomo
+    backend has no deadline, every solve of schedule gets time_budget as time_limit.
+
+    :param options: HiGHS options, the solver is created in the worker
+    :return: starts, connections, seconds spent
+    """
+    start = time.perf_counter()
+    opt = pyo.SolverFactory('appsi_highs')
+    for key, value in options.items():
+        opt.options[key] = value
+
+    if backend == "highs":
+        result = schedule_within(vehicles, customers, radius, opt, time_budget, formulation=formulation,
+                                 vehicle_radius=vehicle_radius)
+        starts, connections = result["starts"], result["connections"]
+    else:
+        opt.options["time_limit"] = time_budget
+        _, starts, connections, _ = schedule(vehicles, customers, radius, opt, formulation, backend=backend,
+                                             vehicle_radius=vehicle_radius)
+
+    return starts, connections, time.perf_counter() - start
+
+
+def decompose_schedule(vehicles, customers, radius, opt, formulation="cuts", backend="highs", clusters=None,
+                       workers=None, time_budget=10.0, repair_budget=1.0, vehicle_radius=None, seed=0,
+                       verbose=False):
+    """
+    Plan a large scenario as independent clusters, solved side by side, then repaired as a whole.
+
+    The clusters come from partition and are solved with solve_cluster on a process pool, HiGHS threads
+    split between the workers by pool_context. Every cluster gets an equal share of time_budget, the
+    clusters a worker solves one after the other share it. A cluster whose solve fails or misses the
+    deadline by more than GRACE falls back to insertion_plan, its worker is terminated with the pool.
+    The stitched plan is repaired with LocalSearch over the whole scenario, which serves the customers a
+    cluster left with a joker and whose moves take customers and chain tails across cluster boundaries.
+
+    :param clusters: number of clusters, defaults to one per CLUSTER_SIZE customers, at most one per vehicle
+    :param workers: processes, defaults to one per core but at most one per cluster
+    :param time_budget: seconds for solving the clusters
+    :param repair_budget: seconds of LocalSearch after stitching
+    :return: starts, connections
+    """
+    if not customers or not vehicles:
+        return [], []
+
+    clusters = clusters or math.ceil(len(customers) / CLUSTER_SIZE)
+    parts = partition(vehicles, customers, min(clusters, len(vehicles)), seed)
+
+    workers = workers or min(os.cpu_count() or 1, len(parts))
+    options = dict(opt.options)
+    context, options["threads"] = pool_context(workers)
+
+    start = time.perf_counter()
+    deadline = start + time_budget
+    cluster_budget = time_budget / math.ceil(len(parts) / workers)
+    starts, connections = [], []
+    pool = context.Pool(workers)
+    try:
+        pending = [pool.apply_async(solve_cluster, (part_vehicles, part_customers, radius, options, formulation,
+                                                    backend, cluster_budget, vehicle_radius))
+                   for part_vehicles, part_customers in parts]
+        for (part_vehicles, part_customers), result in zip(parts, pending):
+            try:
+                part_starts, part_connections, seconds = result.get(max(deadline + GRACE - time.perf_counter(), 0))
+            except TimeoutError:
+                if verbose:
+                    print(f"cluster of {len(part_customers)} customers ran out of time, using insertion_plan")
+                part_starts, part_connections = insertion_plan(part_vehicles, part_customers)
+                seconds = None
+            except Exception as e:
+                if verbose:
+                    print(f"cluster of {len(part_customers)} customers failed ({e}), using insertion_plan")
+                part_starts, part_connections = insertion_plan(part_vehicles, part_customers)
+                seconds = None
+
+            if verbose:
+                print(f"cluster: {len(part_vehicles)} vehicles, {len(part_customers)} customers, {seconds}s")
+            starts += part_starts
+            connections += part_connections
+    finally:
+        pool.terminate()
+
+    if verbose:
+        print(f"solved {len(parts)} clusters on {workers} workers in {time.perf_counter() - start:.2f}s")
+
+    return LocalSearch(vehicles, customers).improve(starts, connections, repair_budget, serve_all=True)
@@ -0,0 +1,112 @@
+import numpy as np
+
+EARTH_RADIUS = 6371000  # meters
+VEHICLE_SPEED = 10  # meters per second, assumed for the runner's vehicles
+ORTOOLS_SCALE = 0.1  # decameters, keeps the routing distances in the range the old 10000 * degree matrix had
+
+
+def haversine(lat1, lon1, lat2, lon2, dtype=np.float64):
+    """
+    Haversine distance in meters, same formula as calculate_distance but on numpy arrays.
+
+    Arguments are broadcast against each other, so passing column and row vectors gives a full matrix.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return (EARTH_RADIUS * c).astype(dtype, copy=False)
+
+
+def haversine_matrix(src, dst, dtype=np.float64):
+    # src, dst: (k, 2) arrays of (lat, lon), result[i, j] is the distance from src[i] to dst[j]
+    src = np.asarray(src, dtype=np.float64).reshape(-1, 2)
+    dst = np.asarray(dst, dtype=np.float64).reshape(-1, 2)
+    return haversine(src[:, 0, None], src[:, 1, None], dst[None, :, 0], dst[None, :, 1], dtype)
+
+
+def unit_vectors(points):
+    # (k, 2) array of (lat, lon) on the unit sphere, |a - b|^2 = 2 - 2 a.b gives the haversine distance with one asin
+    points = np.radians(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+    lat, lon = points[:, 0], points[:, 1]
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def coordinates(vehicles, customers):
+    """
+    :return: vehicle positions, customer pickups and customer dropoffs as (k, 2) arrays of (lat, lon)
+    """
+    vehicle_coords = np.array([(v["coordX"], v["coordY"]) for v in vehicles], dtype=np.float64).reshape(-1, 2)
+    pickups = np.array([(c["coordX"], c["coordY"]) for c in customers], dtype=np.float64).reshape(-1, 2)
+    dropoffs = np.array([(c["destinationX"], c["destinationY"]) for c in customers], dtype=np.float64).reshape(-1, 2)
+    return vehicle_coords, pickups, dropoffs
+
+
+def scenario_matrices(vehicles, customers, dtype=np.float64, dropoff_pickup=True, vehicle_pickup=True):
+    """
+    Compute every distance the scheduler needs in three broadcasted operations.
+
+    :param vehicles: vehicles as returned by the scenario service
+    :param customers: customers as returned by the scenario service
+    :param dtype: float32 halves the memory for large scenarios
+    :param dropoff_pickup: False skips the customers x customers block, the scheduler only needs the pairs
+        within its radius and finds those with a GridIndex
+    :param vehicle_pickup: False skips the vehicles x customers block, for a CandidateGraph with a vehicle_radius
+    :return: dict with
+        "vehicle_pickup": (vehicles, customers) vehicle position -> pickup,
+        "dropoff_pickup": (customers, customers) dropoff of the row customer -> pickup of the column customer,
+        "pickup_dropoff": (customers,) pickup -> dropoff of each customer
+    """
+    vehicle_coords, pickups, dropoffs = coordinates(vehicles, customers)
+
+    matrices = {
+        "pickup_dropoff": haversine(pickups[:, 0], pickups[:, 1], dropoffs[:, 0], dropoffs[:, 1], dtype),
+    }
+    if vehicle_pickup:
+        matrices["vehicle_pickup"] = haversine_matrix(vehicle_coords, pickups, dtype)
+    if dropoff_pickup:
+        matrices["dropoff_pickup"] = haversine_matrix(dropoffs, pickups, dtype)
+
+    return matrices
+
+
+def to_int(matrix, scale=ORTOOLS_SCALE):
+    # OR-Tools only takes integer arc costs
+    return np.rint(np.asarray(matrix, dtype=np.float64) * scale).astype(np.int64)
+
+
+def routing_matrix(vehicles, customers, scale=ORTOOLS_SCALE, matrices=None):
+    """
+    Integer distance matrix for the OR-Tools pickup and delivery model.
+
+    Nodes are [depot, vehicles, pickups, dropoffs], the depot is 0 away from everything. Blocks that are
+    already in matrices (from scenario_matrices) are reused instead of computed again.
+    """
+    vehicle_coords, pickups, dropoffs = coordinates(vehicles, customers)
+    if matrices is None:
+        matrices = scenario_matrices(vehicles, customers)
+
+    m, n = len(vehicle_coords), len(pickups)
+    vehicle_pickup = np.asarray(matrices["vehicle_pickup"], dtype=np.float64)
+    if "dropoff_pickup" in matrices:
+        pickup_dropoff = np.asarray(matrices["dropoff_pickup"], dtype=np.float64).T
+    else:
+        pickup_dropoff = haversine_matrix(pickups, dropoffs)
+
+    dist = np.zeros((1 + m + 2 * n, 1 + m + 2 * n), dtype=np.float64)
+    v, p, d = slice(1, 1 + m), slice(1 + m, 1 + m + n), slice(1 + m + n, 1 + m + 2 * n)
+
+    dist[v, v] = haversine_matrix(vehicle_coords, vehicle_coords)
+    dist[v, p] = vehicle_pickup
+    dist[v, d] = haversine_matrix(vehicle_coords, dropoffs)
+    dist[p, p] = haversine_matrix(pickups, pickups)
+    dist[p, d] = pickup_dropoff
+    dist[d, d] = haversine_matrix(dropoffs, dropoffs)
+
+    # haversine is symmetric, mirror the upper blocks
+    dist[p, v] = dist[v, p].T
+    dist[d, v] = dist[v, d].T
+    dist[d, p] = dist[p, d].T
+
+    return to_int(dist, scale)
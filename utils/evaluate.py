@@ -0,0 +1,83 @@
+import numpy as np
+from utils.distances import VEHICLE_SPEED, coordinates, haversine
+from utils.scheduler import _value
+
+
+class PlanEvaluator:
+    """
+    Score starts and connections without running a simulation.
+
+    Every leg is a straight line at vehicle_speed rounded to whole seconds, the same model as
+    calculate_remaining_travel_time and the Simulator. Coordinates, trip times and values are computed once
+    per scenario, so evaluating a plan is one haversine call over its legs.
+
+    Scores are cumulative by default: a customer waits for everything its vehicle does before the pickup.
+    cumulative=False reproduces the number the scenario services report, which only counts the leg from the
+    assignment to the pickup, so a plan that chains every customer onto one vehicle scores about as well as
+    one that spreads them. Use it to compare with calculate_score, not to choose between plans.
+    """
+
+    def __init__(self, vehicles, customers, vehicle_speed=VEHICLE_SPEED):
+        self.vehicle_coords, self.pickups, self.dropoffs = coordinates(vehicles, customers)
+        self.vehicle_index = {v["id"]: i for i, v in enumerate(vehicles)}
+        self.customer_index = {c["id"]: i for i, c in enumerate(customers)}
+        self.customer_ids = [c["id"] for c in customers]
+        self.vehicle_speed = vehicle_speed
+
+        trip = haversine(self.pickups[:, 0], self.pickups[:, 1], self.dropoffs[:, 0], self.dropoffs[:, 1])
+        self.trip_times = np.round(trip / vehicle_speed)
+        self.values = np.array([_value(d) for d in trip.tolist()])
+
+    def _waits(self, starts, connections, cumulative):
+        # served customer indices in chain order and their wait times
+        successor = dict(connections)
+        served, sources, chain_starts = [], [], []
+        for vehicle, customer in starts:
+            chain_starts.append(len(served))
+            source = self.vehicle_coords[self.vehicle_index[vehicle]]
+            # a chain cannot be longer than all customers, stops a cycle in the connections
+            for _ in self.customer_ids:
+                i = self.customer_index[customer]
+                served.append(i)
+                sources.append(source)
+                source = self.dropoffs[i]
+                if customer not in successor:
+                    break
+                customer = successor[customer]
+
+        served = np.array(served, dtype=np.int64)
+        sources = np.array(sources, dtype=np.float64).reshape(-1, 2)
+        legs = np.round(haversine(sources[:, 0], sources[:, 1], self.pickups[served, 0], self.pickups[served, 1])
+                        / self.vehicle_speed)
+        if not cumulative or not len(served):
+            return served, legs
+
+        # within a chain every customer also waits for the legs and trips in front of it
+        elapsed = np.cumsum(legs + self.trip_times[served])
+        chain_lengths = np.diff(np.append(chain_starts, len(served)))
+        before = np.append(0, elapsed)[chain_starts]
+        return served, elapsed - self.trip_times[served] - np.repeat(before, chain_lengths)
+
+    def wait_times(self, starts, connections, cumulative=True):
+        """
+        :param cumulative: True gives the time from the start of the chain to the pickup, False the time
+            from the assignment to the pickup, which is what update_scenario reports
+        :return: dict customer id -> wait time in seconds for every served customer
+        """
+        served, waits = self._waits(starts, connections, cumulative)
+        return {self.customer_ids[i]: float(w) for i, w in zip(served.tolist(), waits.tolist())}
+
+    def score(self, starts, connections, cumulative=True, joker_penalty=0):
+        """
+        Same sum as calculate_score over the served customers, with the wait_times of cumulative.
+
+        :param joker_penalty: seconds of waiting charged for every customer the plan leaves out, like the
+            joker in the scheduler's loss. Without it a plan scores better the fewer customers it serves
+        """
+        served, waits = self._waits(starts, connections, cumulative)
+        score = float(np.dot(self.values[served], waits))
+        if joker_penalty:
+            unserved = np.ones(len(self.customer_ids), dtype=bool)
+            unserved[served] = False
+            score += joker_penalty * float(self.values[unserved].sum())
+        return score
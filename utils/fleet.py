@@ -0,0 +1,62 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from utils.client import ScenarioClient
+from utils.utils import FleetDispatch, plan_queues
+
+
+async def dispatch_fleet(client, executor, scenario_id, speed, starts, connections):
+    """
+    Same queue following as update_scenario, as a coroutine.
+
+    The blocking client calls run on executor and the waits are the scenario clock's wait (asyncio.sleep for
+    the services), so other fleets in the same event loop keep going while this one waits for its next
+    arrival or for the scenario service.
+
+    :return: dict customer id -> remainingTravelTime reported when the customer was assigned
+    """
+    loop = asyncio.get_running_loop()
+
+    def call(method, *args):
+        return loop.run_in_executor(executor, method, scenario_id, *args)
+
+    first = [{"id": vehicle, "customerId": customer} for vehicle, customer in starts]
+    r_json = await call(client.update_scenario, first)
+
+    clock = client.clock(scenario_id)
+    fleet = FleetDispatch(speed, plan_queues(starts, connections), clock=clock)
+    fleet.dispatched(r_json["updatedVehicles"])
+
+    while fleet.events:
+        await clock.wait(fleet.delay())
+
+        arrived = fleet.arrived()
+        assignments = fleet.assignments(arrived, (await call(client.get_scenario))["vehicles"])
+        if assignments:
+            fleet.dispatched((await call(client.update_scenario, assignments))["updatedVehicles"])
+
+    return fleet.wait_times
+
+
+async def _dispatch_fleets(fleets, client, workers):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = await asyncio.gather(*(dispatch_fleet(client, executor, *fleet) for fleet in fleets),
+                                       return_exceptions=True)
+
+    return {fleet[0]: result for fleet, result in zip(fleets, results)}
+
+
+def dispatch_fleets(fleets, client=None, workers=4):
+    """
+    Dispatch several launched scenarios side by side in one event loop.
+
+    Every fleet has its own timers, a fleet that fails does not stop the others.
+
+    :param fleets: list of (scenario_id, speed, starts, connections), starts and connections as returned by
+        schedule
+    :param client: ScenarioClient or Simulator shared by all fleets, a client's pool should hold at least
+        workers connections
+    :param workers: threads for the HTTP calls
+    :return: dict scenario_id -> wait times as from update_scenario, or the exception its fleet raised
+    """
+    client = client or ScenarioClient(pool_size=workers)
+    return asyncio.run(_dispatch_fleets(fleets, client, workers))
@@ -0,0 +1,179 @@
+import numpy as np
+from utils.distances import coordinates, haversine, scenario_matrices
+from utils.spatial import GridIndex, nearest_pairs, radius_pairs
+
+
+class CandidateGraph:
+    """
+    Customer -> customer arcs the scheduler may use, built once per scenario.
+
+    An arc (c1, c2) means c2 can be picked up after dropping off c1, either because c2's pickup is within
+    radius of c1's dropoff or because c2 is an exception. Arcs are kept as in/out adjacency dicts keyed by
+    customer id, with the dropoff -> pickup distance as value.
+
+    Vehicle -> customer arcs are kept the same way. With a vehicle_radius only pickups within it of the
+    vehicle are kept, plus the nearest one so that every vehicle can start a chain. Both come from radius
+    queries, the vehicles x customers matrix is only computed without a vehicle_radius.
+    """
+
+    def __init__(self, vehicles, customers, radius, matrices=None, vehicle_radius=None):
+        if matrices is None:
+            matrices = scenario_matrices(vehicles, customers, dropoff_pickup=False,
+                                         vehicle_pickup=vehicle_radius is None)
+
+        self.matrices = matrices
+        self.radius = radius
+        self.vehicle_radius = vehicle_radius
+        self.customer_ids = [c["id"] for c in customers]
+        self.vehicle_ids = [v["id"] for v in vehicles]
+        self.customer_index = {cid: i for i, cid in enumerate(self.customer_ids)}
+        self.vehicle_index = {vid: i for i, vid in enumerate(self.vehicle_ids)}
+        self.exceptions = set()
+        self.plan_arcs = set()  # arcs add_plan added, their waiting times are always chained
+
+        self.vehicle_coords, self.pickups, self.dropoffs = coordinates(vehicles, customers)
+
+        self.out_arcs = {cid: {} for cid in self.customer_ids}
+        self.in_arcs = {cid: {} for cid in self.customer_ids}
+
+        # one index over the pickups serves the customer and the vehicle queries
+        index = GridIndex(self.pickups, radius)
+        rows, cols, dists = radius_pairs(self.dropoffs, self.pickups, radius, index)
+        for i, j, d in zip(rows.tolist(), cols.tolist(), dists.tolist()):
+            if i != j:
+                self._add_arc(self.customer_ids[i], self.customer_ids[j], d)
+
+        self.vehicle_arcs = {vid: {} for vid in self.vehicle_ids}
+        self.vehicle_in_arcs = {cid: {} for cid in self.customer_ids}
+
+        if vehicle_radius is None:
+            rows, cols = np.divmod(np.arange(len(self.vehicle_ids) * len(self.customer_ids)),
+                                   max(len(self.customer_ids), 1))
+        else:
+            rows, cols, _ = radius_pairs(self.vehicle_coords, self.pickups, vehicle_radius, index)
+            nearest_rows, nearest_cols, _ = nearest_pairs(self.vehicle_coords, self.pickups, vehicle_radius, index)
+            # row-major like the pairs without a radius, the nearest pickup is often within it already
+            rows, cols = np.divmod(np.unique(np.append(rows * len(self.customer_ids) + cols,
+                                                       nearest_rows * len(self.customer_ids) + nearest_cols)),
+                                   len(self.customer_ids))
+
+        for v, i in zip(rows.tolist(), cols.tolist()):
+            self._add_vehicle_arc(v, i)
+
+    def _add_vehicle_arc(self, v, i):
+        # given matrices can hold more than the distance, e.g. horizon adds the time a vehicle is still busy
+        if "vehicle_pickup" in self.matrices:
+            d = float(self.matrices["vehicle_pickup"][v][i])
+        else:
+            d = float(haversine(*self.vehicle_coords[v], *self.pickups[i]))
+        self.vehicle_arcs[self.vehicle_ids[v]][self.customer_ids[i]] = d
+        self.vehicle_in_arcs[self.customer_ids[i]][self.vehicle_ids[v]] = d
+
+    def _add_arc(self, c1, c2, distance):
+        self.out_arcs[c1][c2] = distance
+        self.in_arcs[c2][c1] = distance
+
+    def add_exception(self, cid):
+        """
+        Make cid reachable from every other customer. Only touches the arcs into cid.
+
+        :return: the arcs that were added
+        """
+        if cid in self.exceptions:
+            return []
+
+        self.exceptions.add(cid)
+        j = self.customer_index[cid]
+        dists = haversine(self.dropoffs[:, 0], self.dropoffs[:, 1], self.pickups[j, 0], self.pickups[j, 1]).tolist()
+
+        added = []
+        for c1, d in zip(self.customer_ids, dists):
+            if c1 != cid and c1 not in self.in_arcs[cid]:
+                self._add_arc(c1, cid, d)
+                added.append((c1, cid))
+
+        return added
+
+    def add_plan(self, starts, connections):
+        """
+        Add the arcs a plan uses that the graph does not have yet, e.g. to pass a heuristic plan as a start.
+
+        The added arcs are chained for every formulation, see chained: with "cuts" a one-way arc without
+        its waiting_time_chained row would let the solver chain customers over it for free.
+
+        :return: the customer -> customer arcs that were added
+        """
+        for vid, cid in starts:
+            if cid not in self.vehicle_arcs[vid]:
+                self._add_vehicle_arc(self.vehicle_index[vid], self.customer_index[cid])
+
+        added = []
+        for c1, c2 in connections:
+            if not self.has_arc(c1, c2):
+                i, j = self.customer_index[c1], self.customer_index[c2]
+                self._add_arc(c1, c2, float(haversine(*self.dropoffs[i], *self.pickups[j])))
+                added.append((c1, c2))
+        self.plan_arcs.update(added)
+
+        return added
+
+    def has_arc(self, c1, c2):
+        return c2 in self.out_arcs[c1]
+
+    def chained(self, c1, c2, formulation):
+        # whether the arc gets a waiting_time_chained row: every arc for "chain", for "cuts" the arcs with
+        # a reverse and the ones add_plan added
+        return formulation == "chain" or self.has_arc(c2, c1) or (c1, c2) in self.plan_arcs
+
+    def successors(self, cid):
+        return self.out_arcs[cid].keys()
+
+    def predecessors(self, cid):
+        return self.in_arcs[cid].keys()
+
+    def arcs(self):
+        return [(c1, c2) for c1, out in self.out_arcs.items() for c2 in out]
+
+    def pair_distances(self):
+        return {(c1, c2): d for c1, out in self.out_arcs.items() for c2, d in out.items()}
+
+    def trip_distances(self):
+        # pickup -> dropoff of each customer
+        return dict(zip(self.customer_ids, np.asarray(self.matrices["pickup_dropoff"], dtype=np.float64).tolist()))
+
+    def vehicle_pairs(self):
+        return [(vid, cid) for vid, out in self.vehicle_arcs.items() for cid in out]
+
+    def vehicle_distances(self):
+        # vehicle position -> pickup for every kept vehicle arc
+        return {(vid, cid): d for vid, out in self.vehicle_arcs.items() for cid, d in out.items()}
+
+
+def plan_cycles(connections):
+    """
+    Cycles among the customer -> customer arcs chosen in a solution.
+
+    :param connections: chosen (customer, next customer) arcs
+    :return: list of cycles as tuples of customer ids
+    """
+    # every customer has at most one successor and one predecessor, so the chosen
+    # arcs form disjoint paths and cycles
+    successor = dict(connections)
+
+    cycles = []
+    visited = set()
+    for start in successor:
+        if start in visited:
+            continue
+
+        path = []
+        customer = start
+        while customer in successor and customer not in visited:
+            visited.add(customer)
+            path.append(customer)
+            customer = successor[customer]
+
+        if customer in path:
+            cycles.append(tuple(path[path.index(customer):]))
+
+    return cycles
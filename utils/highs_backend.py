@@ -0,0 +1,395 @@
+import math
+import os
+import threading
+import time
+import highspy
+import numpy as np
+from utils.graph import plan_cycles
+from utils.presolve import forced_jokers, waiting_time_bounds
+from utils.scheduler import FORMULATIONS, chained_pairs, scenario_data
+
+JOKER_PENALTY = 10000
+PRESOLVE_FACTOR = 10  # HiGHS's presolve takes up to this many times the model build and cannot be interrupted
+SETUP_FACTOR = 3  # the root setup of a solve without presolve cannot be interrupted either, times the model build
+INTERRUPT_LATENCY = 0.05  # seconds solve waits past the deadline for HiGHS to notice the interrupt
+
+
+class HighsScheduler:
+    """
+    The Scheduler model as sparse arrays passed straight to highspy, without Pyomo expressions.
+
+    Same variables, constraints and loss as build_model, in this column order:
+    customer_customer (one per candidate arc), vehicle_customer (one per vehicle arc), waiting_time, joker,
+    then customer_customer columns added by add_exceptions. Rows start with vehicle_max_connection (only
+    for vehicles with more than one arc), customer_max_connection and gets_picked_up_once, so those can be
+    found by index. Bounds, big-Ms and fixed jokers follow waiting_time_bounds and forced_jokers.
+    """
+
+    def __init__(self, graph, formulation="cuts", options=None):
+        if formulation not in FORMULATIONS:
+            raise ValueError(f"unknown formulation {formulation}, expected one of {FORMULATIONS}")
+
+        build_start = time.perf_counter()
+        data = scenario_data(graph)
+        self.graph = graph
+        self.formulation = formulation
+        self.customer_ids = data["customer_ids"]
+        self.vehicle_ids = data["vehicle_ids"]
+        self.valid_pairs = data["valid_pairs"]
+        self.vehicle_pairs = data["vehicle_pairs"]
+        self.bounds = waiting_time_bounds(graph, formulation)
+        self.forced = forced_jokers(graph)
+
+        n, e, k = len(self.customer_ids), len(self.valid_pairs), len(self.vehicle_pairs)
+        c_index = graph.customer_index
+        self.pair_index = {pair: col for col, pair in enumerate(self.valid_pairs)}
+        self.vehicle_pair_index = {pair: e + col for col, pair in enumerate(self.vehicle_pairs)}
+        self.trip = {c: data["customer_distances"][c] for c in self.customer_ids}
+        vehicle_rows = [v for v in self.vehicle_ids if len(graph.vehicle_arcs[v]) > 1]
+
+        # column and row offsets
+        self.vc0 = e
+        self.w0 = e + k
+        self.j0 = e + k + n
+        self.cmc0 = len(vehicle_rows)
+        self.gpo0 = self.cmc0 + n
+        num_col = e + k + 2 * n
+
+        values = np.array([data["customer_values"][c] for c in self.customer_ids])
+
+        cost = np.zeros(num_col)
+        cost[self.w0:self.j0] = values
+        cost[self.j0:] = values * JOKER_PENALTY
+
+        lower_col = np.zeros(num_col)
+        upper = np.ones(num_col)
+        upper[self.w0:self.j0] = [self.bounds[c] for c in self.customer_ids]
+        for c in self.forced:
+            lower_col[self.j0 + c_index[c]] = 1
+            upper[[self.pair_index[(c, c2)] for c2 in graph.successors(c)]] = 0
+
+        rows, cols, vals, lower, upper_row = [], [], [], [], []
+
+        def add_row(row_cols, row_vals, lo, up):
+            rows.append(np.full(len(row_cols), len(lower)))
+            cols.append(np.asarray(row_cols, dtype=np.int32))
+            vals.append(np.asarray(row_vals, dtype=np.float64))
+            lower.append(lo)
+            upper_row.append(up)
+
+        # vehicle_max_connection
+        for v in vehicle_rows:
+            out = [self.vehicle_pair_index[(v, c)] for c in graph.vehicle_arcs[v]]
+            add_row(out, np.ones(len(out)), -highspy.kHighsInf, 1)
+
+        # customer_max_connection: sum of out arcs + joker <= 1
+        for c in self.customer_ids:
+            i = c_index[c]
+            out = [self.pair_index[(c, c2)] for c2 in graph.successors(c)]
+            add_row(out + [self.j0 + i], np.ones(len(out) + 1), -highspy.kHighsInf, 1)
+
+        # gets_picked_up_once: in arcs + vehicles + joker == 1
+        for c in self.customer_ids:
+            i = c_index[c]
+            inc = [self.pair_index[(c1, c)] for c1 in graph.predecessors(c)]
+            vehicles = [self.vehicle_pair_index[(v, c)] for v in graph.vehicle_in_arcs[c]]
+            row_cols = inc + vehicles + [self.j0 + i]
+            add_row(row_cols, np.ones(len(row_cols)), 1, 1)
+
+        # waiting_time_chained: w1 - w2 + M x <= M - d1 - nc_d
+        self.chained_rows = {}
+        for c1, c2 in self.valid_pairs:
+            if graph.chained(c1, c2, formulation):
+                self.chained_rows[c1, c2] = len(lower)
+                add_row(*self._chained_row(c1, c2))
+
+        # waiting_time_start: sum_v vc_d * x_vc - w <= 0, only for customers with a vehicle arc
+        for c in self.customer_ids:
+            if graph.vehicle_in_arcs[c]:
+                vehicles = graph.vehicle_in_arcs[c]
+                add_row([self.vehicle_pair_index[(v, c)] for v in vehicles] + [self.w0 + c_index[c]],
+                        list(vehicles.values()) + [-1], -highspy.kHighsInf, 0)
+
+        rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+        order = np.argsort(rows, kind="stable")
+
+        lp = highspy.HighsLp()
+        lp.num_col_ = num_col
+        lp.num_row_ = len(lower)
+        lp.col_cost_ = cost
+        lp.col_lower_ = lower_col
+        lp.col_upper_ = upper
+        lp.row_lower_ = np.array(lower, dtype=np.float64)
+        lp.row_upper_ = np.array(upper_row, dtype=np.float64)
+        lp.integrality_ = [highspy.HighsVarType.kInteger] * num_col
+        lp.a_matrix_.format_ = highspy.MatrixFormat.kRowwise
+        lp.a_matrix_.start_ = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(lower)))]).astype(np.int32)
+        lp.a_matrix_.index_ = cols[order]
+        lp.a_matrix_.value_ = vals[order]
+
+        self.cost = cost
+        self.deadline = None
+        self.highs = highspy.Highs()
+        self.highs.setOptionValue("output_flag", False)
+        self.highs.setOptionValue("threads", os.cpu_count() or 1)
+        for key, value in (options or {}).items():
+            self.highs.setOptionValue(key, value)
+        self.highs.passModel(lp)
+
+        self.col_value = None
+        self.thread = None
+        self.cuts = 0
+        self.presolve = (options or {}).get("presolve", "choose")
+        self.build_seconds = time.perf_counter() - build_start
+
+    def _big_m(self, c1, c2):
+        # for x = 0 the row has to hold for any w1 up to its bound and w2 >= 0
+        return self.bounds[c1] + self.trip[c1] + self.graph.out_arcs[c1][c2]
+
+    def _chained_row(self, c1, c2):
+        i1, i2 = self.graph.customer_index[c1], self.graph.customer_index[c2]
+        big_m = self._big_m(c1, c2)
+        return ([self.w0 + i1, self.w0 + i2, self.pair_index[c1, c2]], [1, -1, big_m], -highspy.kHighsInf,
+                big_m - self.trip[c1] - self.graph.out_arcs[c1][c2])
+
+    def _update_bounds(self):
+        # new arcs can only raise the waiting time bounds and free forced jokers
+        previous = self.bounds
+        self.bounds = waiting_time_bounds(self.graph, self.formulation)
+        c_index = self.graph.customer_index
+
+        n = len(self.customer_ids)
+        self.highs.changeColsBounds(n, np.arange(self.w0, self.w0 + n, dtype=np.int32), np.zeros(n),
+                                    np.array([self.bounds[c] for c in self.customer_ids], dtype=np.float64))
+
+        for (c1, c2), row in self.chained_rows.items():
+            if self.bounds[c1] != previous[c1]:
+                _, _, lo, up = self._chained_row(c1, c2)
+                self.highs.changeCoeff(row, self.pair_index[c1, c2], self._big_m(c1, c2))
+                self.highs.changeRowBounds(row, lo, up)
+
+        forced = forced_jokers(self.graph)
+        for c in self.forced - forced:
+            self.highs.changeColBounds(self.j0 + c_index[c], 0, 1)
+            for c2 in self.graph.successors(c):
+                self.highs.changeColBounds(self.pair_index[c, c2], 0, 1)
+        self.forced = forced
+
+    def solve(self):
+        """
+        Solve, without a deadline until HiGHS is done.
+
+        With a deadline (set_deadline) HiGHS runs on a thread of its own, highspy releases the GIL, and solve
+        returns None if it is still busy INTERRUPT_LATENCY after the deadline, in a step that does not check for
+        interrupts. HiGHS stops at its next check, call wait before touching the model again.
+        """
+        self.wait()
+        if self.deadline is None:
+            self.highs.run()
+        else:
+            # not a daemon, the interpreter lets HiGHS stop before it exits
+            self.thread = threading.Thread(target=self.highs.run)
+            self.thread.start()
+            self.thread.join(max(self.deadline - time.perf_counter(), 0.0) + INTERRUPT_LATENCY)
+            if self.thread.is_alive():
+                return None
+
+        self.col_value = np.asarray(self.highs.getSolution().col_value)
+        return self.highs.getModelStatus()
+
+    def wait(self):
+        # let a solve that solve gave up on finish
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+            self.col_value = np.asarray(self.highs.getSolution().col_value)
+
+    def on_incumbent(self, callback):
+        """
+        Call callback(incumbent) for every improving solution HiGHS finds during a solve, from HiGHS's thread.
+
+        incumbent is a dict with "starts", "connections", "objective", "bound" and "gap". Solutions whose
+        connections still have cycles (before solve_with_cuts cut them off) are not plans and are skipped.
+        """
+        def improving(event):
+            value = np.asarray(event.data_out.mip_solution)
+            starts, connections = self.extract_plan(value)
+            if not plan_cycles(connections):
+                callback({"starts": starts, "connections": connections,
+                          "objective": event.data_out.objective_function_value,
+                          "bound": event.data_out.mip_dual_bound, "gap": event.data_out.mip_gap})
+
+        self.highs.cbMipImprovingSolution.subscribe(improving)
+
+    def set_deadline(self, deadline):
+        """
+        Stop every following solve at deadline, a time.perf_counter() value, or never with None.
+
+        time_limit alone is only checked every so often, the simplex, IPM and MIP interrupt callbacks also
+        stop a solve within milliseconds wherever HiGHS calls them. Presolve and the root setup of a solve
+        (heuristics, the first LP) call neither and grow with the model, so presolve is switched off when
+        less than PRESOLVE_FACTOR model builds are left. Call it again right before every solve, the choice
+        depends on the time left, and only start the solve if setup_seconds are left. solve returns at the
+        deadline regardless.
+        """
+        if self.deadline is None and deadline is not None:
+            for callback in (self.highs.cbSimplexInterrupt, self.highs.cbIpmInterrupt, self.highs.cbMipInterrupt):
+                callback.subscribe(self._stop)
+
+        self.deadline = deadline
+        if deadline is not None:
+            remaining = deadline - time.perf_counter()
+            self.highs.setOptionValue("presolve", self.presolve if remaining > PRESOLVE_FACTOR * self.build_seconds
+                                      else "off")
+        self.highs.setOptionValue("time_limit", highspy.kHighsInf if deadline is None else
+                                  max(deadline - time.perf_counter(), 0.0))
+
+    @property
+    def setup_seconds(self):
+        # what a solve without presolve takes at least, however short its time limit
+        return SETUP_FACTOR * self.build_seconds
+
+    def _stop(self, event):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            event.interrupt()
+
+    def bound(self):
+        return self.highs.getInfo().mip_dual_bound
+
+    def gap(self):
+        return self.highs.getInfo().mip_gap
+
+    def feasible(self):
+        # a solve stopped by time_limit can come back without any plan
+        return self.highs.getInfo().primal_solution_status == highspy.SolutionStatus.kSolutionStatusFeasible
+
+    def set_start(self, starts, connections, load=False):
+        """
+        Pass a plan, e.g. the previous one when re-planning, as the start solution of the next solve.
+
+        A chain is cut at the first arc the model does not have, the customers behind the cut and the ones
+        the plan leaves out take their joker. Waiting times are the smallest the rows allow for the chosen
+        arcs, so the start is feasible.
+
+        :param load: also make the plan the model's solution, which extract_plan and jokers return
+        :return: the plan's objective
+        """
+        c_index = self.graph.customer_index
+        successor = dict(connections)
+
+        value = np.zeros(self.highs.getNumCol())
+        value[self.j0:self.j0 + len(self.customer_ids)] = 1
+        served = set()
+        for vehicle, customer in starts:
+            if (vehicle, customer) not in self.vehicle_pair_index or customer in served:
+                continue
+
+            value[self.vehicle_pair_index[vehicle, customer]] = 1
+            wait = math.ceil(self.graph.vehicle_arcs[vehicle][customer])
+            while True:
+                i = c_index[customer]
+                served.add(customer)
+                value[self.j0 + i] = 0
+                value[self.w0 + i] = wait
+
+                following = successor.get(customer)
+                if following in served or (customer, following) not in self.pair_index:
+                    break
+
+                value[self.pair_index[customer, following]] = 1
+                if (customer, following) in self.chained_rows:
+                    wait = math.ceil(wait + self.trip[customer] + self.graph.out_arcs[customer][following])
+                else:
+                    wait = 0
+                customer = following
+
+        start = highspy.HighsSolution()
+        start.col_value = list(value)
+        start.value_valid = True
+        self.highs.setSolution(start)
+        if load:
+            self.col_value = value
+        return float(self.cost @ value[:len(self.cost)])
+
+    def add_subset_elimination(self, subset):
+        subset = set(subset)
+        arcs = [self.pair_index[(c1, c2)] for c1 in subset for c2 in self.graph.successors(c1) if c2 in subset]
+        self.highs.addRow(-highspy.kHighsInf, len(subset) - 1, len(arcs), np.array(arcs, dtype=np.int32),
+                          np.ones(len(arcs)))
+        self.cuts += 1
+
+    def add_exceptions(self, customers):
+        """
+        Make customers reachable from every other customer without rebuilding.
+
+        New arcs become new columns in the customer_max_connection and gets_picked_up_once rows they belong
+        to, plus the waiting_time_chained rows they unlock. The plan of the last solve is passed back as the
+        start for the next one, with its waiting times recomputed by set_start: the rows chained_pairs adds
+        for old arcs whose reverse arc is new can cut off the waiting times of the last solution.
+        """
+        previous = self.col_value
+        new_arcs = set()
+        for c in customers:
+            new_arcs.update(self.graph.add_exception(c))
+
+        new_arcs = sorted(new_arcs)
+        if not new_arcs:
+            return new_arcs
+
+        first = self.highs.getNumCol()
+        c_index = self.graph.customer_index
+        indices, starts = [], []
+        for k, (c1, c2) in enumerate(new_arcs):
+            self.pair_index[c1, c2] = first + k
+            self.valid_pairs.append((c1, c2))
+            starts.append(2 * k)
+            indices += [self.cmc0 + c_index[c1], self.gpo0 + c_index[c2]]
+
+        num = len(new_arcs)
+        self.highs.addCols(num, np.zeros(num), np.zeros(num), np.ones(num), len(indices),
+                           np.array(starts, dtype=np.int32), np.array(indices, dtype=np.int32), np.ones(len(indices)))
+        self.highs.changeColsIntegrality(num, np.arange(first, first + num, dtype=np.int32),
+                                         np.array([highspy.HighsVarType.kInteger] * num))
+
+        for c1, c2 in chained_pairs(self.graph, set(new_arcs), self.formulation):
+            row_cols, row_vals, lo, up = self._chained_row(c1, c2)
+            self.chained_rows[c1, c2] = self.highs.getNumRow()
+            self.highs.addRow(lo, up, len(row_cols), np.array(row_cols, dtype=np.int32), np.array(row_vals, dtype=np.float64))
+
+        self._update_bounds()
+
+        if previous is not None:
+            self.set_start(*self.extract_plan(np.append(previous, np.zeros(num))))
+
+        return new_arcs
+
+    def solve_with_cuts(self):
+        # same lazy subset elimination as scheduler.solve_with_cuts
+        while True:
+            status = self.solve()
+            cycles = plan_cycles(self.extract_plan()[1])
+
+            if not cycles:
+                return status
+
+            for cycle in cycles:
+                self.add_subset_elimination(cycle)
+
+    def _chosen(self, value, start, stop):
+        return np.nonzero(value[start:stop] > 0.5)[0]
+
+    def jokers(self, value=None):
+        value = self.col_value if value is None else value
+        return [self.customer_ids[i] for i in self._chosen(value, self.j0, self.j0 + len(self.customer_ids))]
+
+    def extract_plan(self, value=None):
+        # of the last solve, or of any column values like an incumbent's
+        value = self.col_value if value is None else value
+        connections = [pair for pair, col in self.pair_index.items() if value[col] > 0.5]
+        starts = [self.vehicle_pairs[k] for k in self._chosen(value, self.vc0, self.w0)]
+        return starts, connections
+
+    def objective(self):
+        return self.highs.getInfo().objective_function_value
+
+    def write(self, filename):
+        self.highs.writeModel(filename)
@@ -0,0 +1,92 @@
+import numpy as np
+from utils.distances import EARTH_RADIUS, coordinates, scenario_matrices, unit_vectors
+from utils.scheduler import _value
+
+REGRET_CANDIDATES = 8  # vehicles whose cheapest customers compete on regret each step
+
+
+def _insert(vehicles, customers, matrices, regret):
+    # one insertion run, see insertion_plan
+    n, m = len(customers), len(vehicles)
+    _, pickups, dropoffs = coordinates([], customers)
+    trip = np.asarray(matrices["pickup_dropoff"], dtype=np.float64)
+    values = np.array([_value(d) for d in trip.tolist()])
+
+    pickups, dropoffs = unit_vectors(pickups), unit_vectors(dropoffs)
+
+    def from_dropoff(i):
+        # meters from the dropoff of customer i to every pickup
+        return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip((1 - pickups @ dropoffs[i]) / 2, 0, 1)))
+
+    # cost[r, i] of appending customer i to vehicle r, inf once i is served
+    cost = values * np.asarray(matrices["vehicle_pickup"], dtype=np.float64).reshape(m, n)
+    served = np.zeros(n, dtype=bool)
+    driven = np.zeros(m)
+    last = [None] * m
+    favourite = cost.argmin(axis=1)  # cheapest customer of every vehicle
+    vehicle_range = np.arange(m)
+
+    starts, connections, loss = [], [], 0.0
+    for _ in range(n):
+        if regret and m > 1:
+            # the cheapest customers of the REGRET_CANDIDATES cheapest vehicles
+            vehicles_first = np.argsort(cost[vehicle_range, favourite])[:REGRET_CANDIDATES]
+            candidates = np.unique(favourite[vehicles_first])
+            two = np.partition(cost[:, candidates], 1, axis=0)
+            i = int(candidates[np.argmax(two[1] - two[0])])
+            r = int(cost[:, i].argmin())
+        else:
+            r = int(cost[vehicle_range, favourite].argmin())
+            i = int(favourite[r])
+
+        if last[r] is None:
+            starts.append((vehicles[r]["id"], customers[i]["id"]))
+        else:
+            connections.append((customers[last[r]]["id"], customers[i]["id"]))
+
+        loss += cost[r, i]
+        driven[r] = cost[r, i] / values[i] + trip[i]  # cost already holds driven[r] and the lead
+        last[r] = i
+
+        served[i] = True
+        cost[:, i] = np.inf
+        cost[r] = np.where(served, np.inf, values * (driven[r] + from_dropoff(i)))
+
+        # only r's row and i's column changed
+        for s in {r, *np.nonzero(favourite == i)[0].tolist()}:
+            favourite[s] = cost[s].argmin()
+
+    return starts, connections, loss
+
+
+def insertion_plan(vehicles, customers, matrices=None, regret=True):
+    """
+    Regret insertion heuristic for the Scheduler objective, without a solver.
+
+    Customers are appended one at a time to the end of a vehicle's chain. Appending customer i to vehicle r
+    costs value_i * (meters r has driven so far + distance from its last dropoff to i's pickup), the
+    customer's term in the Scheduler loss. Every vehicle keeps its cheapest customer, among those the one
+    whose best vehicle is most ahead of its second best goes next (regret-2), only the cheapest
+    customers of the REGRET_CANDIDATES cheapest vehicles are compared. Greedy, the cheapest append
+    overall, is the fallback: it always runs and the plan with the lower loss is kept. With a single
+    vehicle there is no regret.
+
+    An append only changes one row and one column of the cost matrix, so a step is O(customers + vehicles)
+    and a few thousand customers take a fraction of a second.
+
+    :param matrices: from scenario_matrices, only "vehicle_pickup" and "pickup_dropoff" are used, computed here
+        without "vehicle_pickup", like a CandidateGraph with a vehicle_radius has them
+    :return: starts, connections like schedule, every customer is served
+    """
+    if not customers or not vehicles:
+        return [], []
+
+    if matrices is None or "vehicle_pickup" not in matrices:
+        matrices = scenario_matrices(vehicles, customers, dropoff_pickup=False)
+
+    plans = [_insert(vehicles, customers, matrices, False)]
+    if regret and len(vehicles) > 1:
+        plans.append(_insert(vehicles, customers, matrices, True))
+
+    starts, connections, _ = min(plans, key=lambda plan: plan[2])
+    return starts, connections
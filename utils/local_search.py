@@ -0,0 +1,285 @@
+import math
+import time
+import numpy as np
+from utils.distances import EARTH_RADIUS, coordinates, haversine, haversine_matrix, unit_vectors
+from utils.scheduler import _value
+
+NEIGHBOURS = 10  # customers whose dropoff is closest to a pickup, the only predecessors a move tries
+VEHICLE_NEIGHBOURS = 3  # vehicles closest to a pickup, the only chain starts a move tries
+EPSILON = 1e-6  # smallest improvement in loss that counts
+
+
+def _nearest(src, dst, k, exclude_self=False, chunk=256):
+    # for every dst point the k src points closest to it, without the full matrix in memory
+    k = min(k, len(src) - exclude_self)
+    nearest = []
+    for lo in range(0, len(dst), chunk):
+        block = haversine_matrix(src, dst[lo:lo + chunk])
+        if exclude_self:
+            block[np.arange(lo, lo + block.shape[1]), np.arange(block.shape[1])] = np.inf
+        if k <= 0:
+            nearest += [[] for _ in range(block.shape[1])]
+            continue
+        part = np.argpartition(block, k - 1, axis=0)[:k]
+        nearest += part.T.tolist()
+
+    return nearest
+
+
+class _Route:
+    """
+    One vehicle's chain with the arrival at every pickup (meters driven before it) and the suffix sums of
+    the values behind every position, which is what the move deltas need.
+    """
+
+    __slots__ = ("vehicle", "customers", "arrival", "suffix")
+
+    def __init__(self, vehicle, customers):
+        self.vehicle = vehicle
+        self.customers = customers
+
+
+class LocalSearch:
+    """
+    Local search over the chains of a plan, for the Scheduler loss: every customer is weighted with its
+    value times the meters its vehicle drove before the pickup.
+
+    The moves are relocate (a customer behind another one or at the start of a vehicle), swap (two
+    customers trade places), 2-opt (reverse a piece of a chain) and exchange (two chains trade their tails).
+    Each customer only tries its NEIGHBOURS nearest predecessors and VEHICLE_NEIGHBOURS nearest vehicles.
+    Moves between two chains are scored in O(1) from the cached arrivals and suffix sums, moves inside
+    one chain by re-evaluating that chain.
+    """
+
+    def __init__(self, vehicles, customers, matrices=None, neighbours=NEIGHBOURS,
+                 vehicle_neighbours=VEHICLE_NEIGHBOURS):
+        vehicle_coords, pickups, dropoffs = coordinates(vehicles, customers)
+        self.vehicles, self.customers = vehicles, customers
+        self.vehicle_index = {v["id"]: r for r, v in enumerate(vehicles)}
+        self.customer_index = {c["id"]: i for i, c in enumerate(customers)}
+
+        if matrices is None:
+            trip = haversine(pickups[:, 0], pickups[:, 1], dropoffs[:, 0], dropoffs[:, 1])
+        else:
+            trip = np.asarray(matrices["pickup_dropoff"], dtype=np.float64)
+        self.trip = trip.tolist()
+        self.values = [_value(d) for d in self.trip]
+
+        # lists, the moves look up single points, which is faster than indexing an array
+        self.vehicle_units, self.pickup_units, self.dropoff_units = (
+            unit_vectors(points).tolist() for points in (vehicle_coords, pickups, dropoffs))
+        self.near_customers = _nearest(dropoffs, pickups, neighbours, exclude_self=True)
+        self.near_vehicles = _nearest(vehicle_coords, pickups, vehicle_neighbours) if len(vehicles) else []
+
+    @staticmethod
+    def _distance(a, b):
+        dot = a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+        return 2 * EARTH_RADIUS * math.asin(math.sqrt(min(max((1 - dot) / 2, 0), 1)))
+
+    def _lead(self, route, q, c):
+        # meters from the point before position q of route to the pickup of c
+        if q == 0:
+            return self._distance(self.vehicle_units[route.vehicle], self.pickup_units[c])
+        return self._distance(self.dropoff_units[route.customers[q - 1]], self.pickup_units[c])
+
+    def _link(self, c1, c2):
+        # meters from the dropoff of c1 to the pickup of c2
+        return self._distance(self.dropoff_units[c1], self.pickup_units[c2])
+
+    def _ready(self, route, q):
+        # meters driven when the vehicle leaves for position q
+        if q == 0:
+            return 0.0
+        return route.arrival[q - 1] + self.trip[route.customers[q - 1]]
+
+    def _evaluate(self, vehicle, customers):
+        # loss of a chain, its arrivals and suffix sums
+        arrival, driven = [], 0.0
+        point = self.vehicle_units[vehicle]
+        for c in customers:
+            driven += self._distance(point, self.pickup_units[c])
+            arrival.append(driven)
+            driven += self.trip[c]
+            point = self.dropoff_units[c]
+
+        suffix = [0.0] * len(customers)
+        total = 0.0
+        for q in range(len(customers) - 1, -1, -1):
+            total += self.values[customers[q]]
+            suffix[q] = total
+
+        loss = sum(self.values[c] * a for c, a in zip(customers, arrival))
+        return loss, arrival, suffix
+
+    def _set(self, route, customers):
+        route.customers = customers
+        _, route.arrival, route.suffix = self._evaluate(route.vehicle, customers)
+        for q, c in enumerate(customers):
+            self.where[c] = (route, q)
+
+    def _remove_delta(self, route, i):
+        c = route.customers[i]
+        delta = -self.values[c] * route.arrival[i]
+        if i + 1 < len(route.customers):
+            following = route.customers[i + 1]
+            shift = (self._lead(route, i, c) + self.trip[c] + self._link(c, following)
+                     - self._lead(route, i, following))
+            delta -= route.suffix[i + 1] * shift
+        return delta
+
+    def _insert_delta(self, route, q, c):
+        delta = self.values[c] * (self._ready(route, q) + self._lead(route, q, c))
+        if q < len(route.customers):
+            following = route.customers[q]
+            shift = (self._lead(route, q, c) + self.trip[c] + self._link(c, following)
+                     - self._lead(route, q, following))
+            delta += route.suffix[q] * shift
+        return delta
+
+    def _replace_delta(self, route, i, c):
+        # c takes the place of the customer at position i
+        old = route.customers[i]
+        delta = self.values[c] * (self._ready(route, i) + self._lead(route, i, c)) - self.values[old] * route.arrival[i]
+        if i + 1 < len(route.customers):
+            following = route.customers[i + 1]
+            shift = (self._lead(route, i, c) + self.trip[c] + self._link(c, following)
+                     - self._lead(route, i, old) - self.trip[old] - self._link(old, following))
+            delta += route.suffix[i + 1] * shift
+        return delta
+
+    def _tails_delta(self, a, i, b, q):
+        # a keeps a[:i] and continues with b[q:], b keeps b[:q] and continues with a[i:]
+        delta = 0.0
+        if i < len(a.customers):
+            delta += a.suffix[i] * (self._ready(b, q) + self._lead(b, q, a.customers[i]) - a.arrival[i])
+        if q < len(b.customers):
+            delta += b.suffix[q] * (self._ready(a, i) + self._lead(a, i, b.customers[q]) - b.arrival[q])
+        return delta
+
+    def _within(self, route, customers):
+        # delta of replacing a chain's order, scored by evaluating the chain
+        loss, _, _ = self._evaluate(route.vehicle, customers)
+        old = sum(self.values[c] * a for c, a in zip(route.customers, route.arrival))
+        return loss - old
+
+    def _chain(self, kind, a, i, q):
+        # new order of a single chain for a move inside it
+        chain = a.customers
+        if kind == "relocate":
+            rest = chain[:i] + chain[i + 1:]
+            target = q if q < i else q - 1
+            return rest[:target] + [chain[i]] + rest[target:]
+        if kind == "swap":
+            swapped = list(chain)
+            swapped[i], swapped[q] = swapped[q], swapped[i]
+            return swapped
+        return chain[:q] + chain[q:i + 1][::-1] + chain[i + 1:]
+
+    def _moves(self, c):
+        # (delta, kind, route, position) for every move that puts c directly behind one of its neighbours,
+        # position is where c ends up in route
+        a, i = self.where[c]
+        for b, q in self._places(c):
+            if b is a:
+                # q == i is c's own place, q == i + 1 is not a neighbour
+                if q != i and q != i + 1:
+                    yield self._within(a, self._chain("relocate", a, i, q)), "relocate", b, q
+                    if q < len(a.customers):
+                        yield self._within(a, self._chain("swap", a, i, q)), "swap", b, q
+                if q < i:
+                    yield self._within(a, self._chain("2-opt", a, i, q)), "2-opt", b, q
+                continue
+
+            yield self._remove_delta(a, i) + self._insert_delta(b, q, c), "relocate", b, q
+            if q < len(b.customers):
+                yield self._replace_delta(a, i, b.customers[q]) + self._replace_delta(b, q, c), "swap", b, q
+            yield self._tails_delta(a, i, b, q), "exchange", b, q
+
+    def _apply(self, c, kind, b, q):
+        a, i = self.where[c]
+        if b is a:
+            self._set(a, self._chain(kind, a, i, q))
+        elif kind == "relocate":
+            self._set(a, a.customers[:i] + a.customers[i + 1:])
+            self._set(b, b.customers[:q] + [c] + b.customers[q:])
+        elif kind == "swap":
+            other = b.customers[q]
+            self._set(a, a.customers[:i] + [other] + a.customers[i + 1:])
+            self._set(b, b.customers[:q] + [c] + b.customers[q + 1:])
+        else:
+            tail_a, tail_b = a.customers[i:], b.customers[q:]
+            self._set(a, a.customers[:i] + tail_b)
+            self._set(b, b.customers[:q] + tail_a)
+
+    def loss(self):
+        return sum(self.values[c] * a for route in self.routes for c, a in zip(route.customers, route.arrival))
+
+    def _places(self, c):
+        # (route, position) right behind c's neighbours
+        places = [(self.routes[v], 0) for v in self.near_vehicles[c]]
+        return places + [(place[0], place[1] + 1) for place in map(self.where.get, self.near_customers[c]) if place]
+
+    def improve(self, starts, connections, time_budget=1.0, serve_all=False):
+        """
+        Improve a plan until no move helps any more or time_budget seconds are up.
+
+        Every pass visits the served customers and applies the best improving move of each. Customers the
+        plan leaves out (jokers) stay out, unless serve_all puts them in first at their cheapest place behind
+        a neighbour, whatever the budget.
+
+        :return: starts, connections of the improved plan
+        """
+        deadline = time.perf_counter() + time_budget
+        successor = dict(connections)
+
+        self.where = {}
+        self.routes = [_Route(r, []) for r in range(len(self.vehicles))]
+        # a chain ends at a customer that is already placed, which stops cycles in connections
+        placed = set()
+        for vehicle, customer in starts:
+            chain = []
+            while customer is not None and customer not in placed:
+                placed.add(customer)
+                chain.append(customer)
+                customer = successor.get(customer)
+            self._set(self.routes[self.vehicle_index[vehicle]], [self.customer_index[cid] for cid in chain])
+
+        if serve_all and self.vehicles:
+            for c in range(len(self.customers)):
+                if c not in self.where:
+                    route, q = min(self._places(c), key=lambda place: self._insert_delta(place[0], place[1], c))
+                    self._set(route, route.customers[:q] + [c] + route.customers[q:])
+
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            for c in list(self.where):
+                if time.perf_counter() >= deadline:
+                    break
+
+                delta, kind, route, q = min(self._moves(c), key=lambda move: move[0], default=(0, None, None, None))
+                if delta < -EPSILON:
+                    self._apply(c, kind, route, q)
+                    improved = True
+
+        starts, connections = [], []
+        for route in self.routes:
+            chain = [self.customers[c]["id"] for c in route.customers]
+            if chain:
+                starts.append((self.vehicles[route.vehicle]["id"], chain[0]))
+                connections += list(zip(chain, chain[1:]))
+
+        return starts, connections
+
+
+def improve(vehicles, customers, starts, connections, matrices=None, time_budget=1.0):
+    """
+    Improve any plan, e.g. from schedule or insertion_plan, with LocalSearch.
+
+    :param matrices: from scenario_matrices, only "pickup_dropoff" is used
+    :param time_budget: seconds, including the neighbour lists
+    :return: starts, connections
+    """
+    start = time.perf_counter()
+    search = LocalSearch(vehicles, customers, matrices)
+    return search.improve(starts, connections, time_budget - (time.perf_counter() - start))
@@ -0,0 +1,185 @@
+import time
+import numpy as np
+from utils.distances import VEHICLE_SPEED, coordinates, haversine, haversine_matrix
+from utils.graph import CandidateGraph, plan_cycles
+from utils.presolve import presolve_exceptions
+from utils.utils import FleetDispatch, plan_queues
+
+MIN_SOLVE_TIME = 0.01  # seconds HiGHS still gets when building the model used up the budget
+
+
+def horizon(scenario, vehicle_speed=VEHICLE_SPEED):
+    """
+    The part of a get_scenario answer that can still be planned.
+
+    Customers that are already assigned are frozen with their vehicle and left out. A busy vehicle starts
+    its next chain at its customer's destination once its remainingTravelTime is over, that delay is added
+    to its vehicle -> pickup distances as meters at vehicle_speed, the unit the scheduler works in. The
+    runner only reports the current leg, so for a vehicle still on its way to the pickup the trip is missing.
+
+    :return: vehicles at the position they start their next chain from, the customers awaiting service
+        and the matrices for CandidateGraph
+    """
+    by_id = {c["id"]: c for c in scenario["customers"]}
+    customers = [c for c in scenario["customers"] if c["awaitingService"]]
+
+    vehicles, delays = [], []
+    for v in scenario["vehicles"]:
+        if v.get("customerId") and v.get("remainingTravelTime"):
+            c = by_id[v["customerId"]]
+            vehicles.append(dict(v, coordX=c["destinationX"], coordY=c["destinationY"]))
+            delays.append(v["remainingTravelTime"] * vehicle_speed)
+        else:
+            vehicles.append(v)
+            delays.append(0)
+
+    vehicle_coords, pickups, dropoffs = coordinates(vehicles, customers)
+    matrices = {
+        "vehicle_pickup": haversine_matrix(vehicle_coords, pickups) + np.array(delays, dtype=np.float64)[:, None],
+        "pickup_dropoff": haversine(pickups[:, 0], pickups[:, 1], dropoffs[:, 0], dropoffs[:, 1]),
+    }
+    return vehicles, customers, matrices
+
+
+def queue_plan(queues):
+    # the starts and connections that serve every queue in order
+    starts = [(v, q[0]) for v, q in queues.items() if q]
+    connections = [pair for q in queues.values() for pair in zip(q, q[1:])]
+    return starts, connections
+
+
+def append_nearest(queues, missing, vehicles, customers):
+    # put every missing customer behind the queue that ends closest to its pickup
+    by_id = {c["id"]: c for c in customers}
+    ends = {}
+    for v in vehicles:
+        queue = queues.setdefault(v["id"], [])
+        last = by_id.get(queue[-1]) if queue else None
+        ends[v["id"]] = (last["destinationX"], last["destinationY"]) if last else (v["coordX"], v["coordY"])
+
+    ids = list(ends)
+    for cid in missing:
+        c = by_id[cid]
+        points = np.array([ends[v] for v in ids])
+        v = ids[int(np.argmin(haversine(points[:, 0], points[:, 1], c["coordX"], c["coordY"])))]
+        queues[v].append(cid)
+        ends[v] = (c["destinationX"], c["destinationY"])
+
+    return {v: q for v, q in queues.items() if q}
+
+
+def replan(scenario, queues, radius, budget=1.0, options=None, formulation="cuts"):
+    """
+    Plan the customers that are still awaiting service from the current vehicle positions, see horizon.
+
+    The previous queues are the start solution, their arcs are added to the graph (CandidateGraph.add_plan),
+    so within the budget HiGHS can only improve on them. "cuts" solves like solve_with_cuts until the plan
+    has no cycles, "chain" needs no cut rounds but its cumulative waiting times make the MILP much harder,
+    see compare_formulations. If no plan without cycles is found within the budget the previous queues are
+    kept. Customers without a place in the plan (new ones, jokers) go behind the nearest queue.
+
+    :param queues: vehicle id -> customers it serves next, as planned before
+    :param budget: seconds for building and solving the model
+    :param options: HiGHS options, the solve is stopped at the end of the budget
+    :param formulation: see build_model
+    :return: vehicle id -> customers it serves next, its first one included
+    """
+    start = time.perf_counter()
+    vehicles, customers, matrices = horizon(scenario)
+    remaining = {c["id"] for c in customers}
+    previous = {v: [c for c in q if c in remaining] for v, q in queues.items()}
+    if not customers:
+        return {}
+
+    # highspy is only loaded once a plan is solved, the portfolio forks OR-Tools workers that cannot load both
+    from utils.highs_backend import HighsScheduler
+
+    graph = CandidateGraph(vehicles, customers, radius, matrices)
+    presolve_exceptions(graph)
+    graph.add_plan(*queue_plan(previous))
+
+    model = HighsScheduler(graph, formulation, options)
+    # building the model is charged to the budget too
+    deadline = max(start + budget, time.perf_counter() + MIN_SOLVE_TIME)
+    planned = previous
+    while True:
+        model.set_start(*queue_plan(previous))
+        model.set_deadline(deadline)
+        if model.solve() is None or not model.feasible():
+            break
+
+        starts, connections = model.extract_plan()
+        cycles = plan_cycles(connections)
+        if not cycles:
+            tails = plan_queues(starts, connections)
+            planned = {v: [c] + tails.get(v, []) for v, c in starts}
+            break
+
+        if time.perf_counter() >= deadline:
+            break
+        for cycle in cycles:
+            model.add_subset_elimination(cycle)
+
+    served = {c for q in planned.values() for c in q}
+    return append_nearest(planned, [c for c in graph.customer_ids if c not in served], vehicles, customers)
+
+
+def dispatch_online(client, scenario_id, speed, radius, budget=1.0, interval=None, on_arrival=True, options=None,
+                    verbose=False, plan=None, formulation="cuts"):
+    """
+    Dispatch a launched scenario while re-planning it as it runs (rolling horizon).
+
+    The first plan is dispatched as it is, then redone with replan every interval simulation seconds and,
+    with on_arrival, whenever a vehicle finishes a trip, always starting from the queues that are left.
+    Between re-plans the vehicles follow their queues like dispatch_queues. Every re-plan is limited to
+    budget seconds, dispatch waits for at most that long.
+
+    :param interval: simulation seconds between re-plans, None only re-plans on arrivals
+    :param options: HiGHS options, e.g. dict(opt.options)
+    :param formulation: of every re-plan, see replan
+    :param plan: starts, connections to dispatch first, e.g. from schedule, None or a plan without starts
+        plans with replan right away. Customers it leaves out get their place with the first re-plan
+    :return: dict customer id -> remainingTravelTime reported when the customer was assigned
+    """
+    clock = client.clock(scenario_id)
+    if plan is None or not plan[0]:
+        queues = replan(client.get_scenario(scenario_id), {}, radius, budget, options, formulation)
+    else:
+        tails = plan_queues(*plan)
+        queues = {v: [c] + tails.get(v, []) for v, c in plan[0]}
+    fleet = FleetDispatch(speed, queues, verbose, clock)
+    first = [{"id": v, "customerId": q.pop(0)} for v, q in queues.items()]
+    if first:
+        fleet.dispatched(client.update_scenario(scenario_id, first)["updatedVehicles"])
+    planned_at = fleet.now()
+
+    while fleet.events:
+        delay = fleet.delay()
+        if interval is not None:
+            delay = min(delay, max((planned_at + interval - fleet.now()) * speed, 0))
+        clock.sleep(delay)
+
+        arrived = fleet.arrived()
+        scenario = client.get_scenario(scenario_id)
+        free = [v["id"] for v in scenario["vehicles"] if not v["remainingTravelTime"]]
+
+        # once every customer is assigned there is nothing left to re-plan
+        waiting = any(c["awaitingService"] for c in scenario["customers"])
+        due = interval is not None and fleet.now() >= planned_at + interval - 1e-6
+        if waiting and (due or (on_arrival and set(free) & set(arrived))):
+            start = time.perf_counter()
+            fleet.queues = replan(scenario, fleet.queues, radius, budget, options, formulation)
+            planned_at = fleet.now()
+            if verbose:
+                print(f"Re-planned {sum(map(len, fleet.queues.values()))} customers in "
+                      f"{time.perf_counter() - start:.2f}s")
+
+            # a vehicle that ran out of customers is off the heap, the new plan can give it some again
+            pending = {v for _, v in fleet.events}
+            arrived += [v for v in free if v not in pending and v not in arrived and fleet.queues.get(v)]
+
+        assignments = fleet.assignments(arrived, scenario["vehicles"])
+        if assignments:
+            fleet.dispatched(client.update_scenario(scenario_id, assignments)["updatedVehicles"])
+
+    return fleet.wait_times
@@ -1,189 +1,207 @@
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
-import numpy as np
-
-
-def create_array(cars, customers):
-    size = 1 + len(cars) + 2 * len(customers)
-    len_cars = len(cars)
-    len_customers = len(customers)
-    complete = [0] + cars + customers + customers
-    arr = [[0 for _ in range(size)] for _ in range(size)]
-
-    for i in range(1, size):
-        for j in range(i, size):
-            if i <= len_cars + len_customers and j <= len_cars + len_customers:
-                arr[i][j] = int(10000 * np.sqrt(np.power(complete[i]["coordX"] - complete[j]["coordX"], 2) +
-                                    np.power(complete[i]["coordY"] - complete[j]["coordY"], 2)))
-
-            elif i <= len_cars + len_customers < j:
-                arr[i][j] = int(10000 * np.sqrt(np.power(complete[i]["coordX"] - complete[j]["destinationX"], 2) +
-                                    np.power(complete[i]["coordY"] - complete[j]["destinationY"], 2)))
-
-            elif i > len_cars + len_customers >= j:
-                arr[i][j] = int(10000 * np.sqrt(np.power(complete[i]["destinationX"] - complete[j]["coordX"], 2) +
-                                    np.power(complete[i]["destinationY"] - complete[j]["coordY"], 2)))
-
-            elif i > len_cars + len_customers and j > len_customers + len_cars:
-                arr[i][j] = int(10000 * np.sqrt(np.power(complete[i]["destinationX"] - complete[j]["destinationX"], 2) +
-                                    np.power(complete[i]["destinationY"] - complete[j]["destinationY"], 2)))
-
-            if i != j:
-                arr[j][i] = arr[i][j]
-    return arr
-
-
-def create_data_model(cars, customers):
-    """Stores the data for the problem."""
-    len_cars = len(cars)
-    len_customers = len(customers)
-
-    data = {}
-
-    #data["distance_matrix"] = [
-         #fmt: off
-     #   [0, 0, 0, 0, 0, 0, 0],
-      #  [0, 0, 100, 5, 10, 2, 2],
-       # [0, 100, 0, 20, 5, 2, 2],
-       # [0, 5, 20, 0, 2, 1, 2],
-       # [0, 10, 5, 1, 0, 2, 1],
-       # [0, 2, 2, 2, 1, 0, 100],
-       # [0, 2, 2, 2, 1, 100, 0]
-        # fmt: on
-    #]
-
-    data["distance_matrix"] = create_array(cars, customers)
-
-    #data["pickups_deliveries"] = [
-     #   [3, 5],
-      #  [4, 6],
-    #]
-
-    data["pickups_deliveries"] = [
-        [i, i + len_customers] for i in range(1 + len_cars, 1 + len_cars + len_customers)
-    ]
-
-    data["num_vehicles"] = len_cars
-    #data["num_vehicles"] = 2
-
-    data["starts"] = [i for i in range(1, len_cars + 1)]
-    #data["starts"] = [1, 2]
-
-    data["ends"] = [0 for _ in range(len_cars)]
-    #data["ends"] = [0, 0]
-
-    data["vehicle_capacities"] = [1 for _ in range(len_cars)]
-    data["demands"] = [0] + [0 for _ in range(len_cars)] + [1 for _ in range(len_customers)] + [-1 for _ in range(len_customers)]
-
-    return data
-
-
-def print_solution(data, manager, routing, solution, cars, customers):
-    """Prints solution on console."""
-    print(f"Objective: {solution.ObjectiveValue()}")
-    route_per_car = []
-    len_car = len(cars)
-    len_customer = len(customers)
-    total_distance = 0
-    for vehicle_id in range(data["num_vehicles"]):
-        route_per_car.append([])
-        index = routing.Start(vehicle_id)
-        plan_output = f"Route for vehicle {vehicle_id}:\n"
-        route_distance = 0
-        while not routing.IsEnd(index):
-            route_per_car[vehicle_id].append(index - len_car)
-            plan_output += f" {manager.IndexToNode(index)} -> "
-            previous_index = index
-            index = solution.Value(routing.NextVar(index))
-            route_distance += routing.GetArcCostForVehicle(
-                previous_index, index, vehicle_id
-            )
-        plan_output += f"{manager.IndexToNode(index)}\n"
-        plan_output += f"Distance of the route: {route_distance}m\n"
-        print(plan_output)
-        total_distance += route_distance
-    print(f"Total Distance of all routes: {total_distance}m")
-    return route_per_car
-
-
-def solve(cars, customers):
-    """Entry point of the program."""
-    # Instantiate the data problem.
-    data = create_data_model(cars, customers)
-
-    # Create the routing index manager.
-    manager = pywrapcp.RoutingIndexManager(
-        len(data["distance_matrix"]), data["num_vehicles"], data["starts"], data["ends"]
-    )
-
-    # Create Routing Model.
-    routing = pywrapcp.RoutingModel(manager)
-
-    # Define cost of each arc.
-    def distance_callback(from_index, to_index):
-        """Returns the manhattan distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data["distance_matrix"][from_node][to_node]
-
-    def demand_callback(from_index):
-        """Returns the demand of the node."""
-        # Convert from routing variable Index to demands NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        return data['demands'][from_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-    demand_callback_index = routing.RegisterUnaryTransitCallback(
-        demand_callback)
-    routing.AddDimensionWithVehicleCapacity(
-        demand_callback_index,
-        0,  # null capacity slack
-        data['vehicle_capacities'],  # vehicle maximum capacities
-        True,  # start cumul to zero
-        'Capacity')
-
-    # Add Distance constraint.
-    dimension_name = "Distance"
-    routing.AddDimension(
-        transit_callback_index,
-        0,  # no slack
-        3000,  # vehicle maximum travel distance
-        True,  # start cumul to zero
-        dimension_name,
-    )
-    distance_dimension = routing.GetDimensionOrDie(dimension_name)
-    distance_dimension.SetGlobalSpanCostCoefficient(100)
-
-    # Define Transportation Requests.
-    for request in data["pickups_deliveries"]:
-        pickup_index = manager.NodeToIndex(request[0])
-        delivery_index = manager.NodeToIndex(request[1])
-        routing.AddPickupAndDelivery(pickup_index, delivery_index)
-        routing.solver().Add(
-            routing.VehicleVar(pickup_index) == routing.VehicleVar(delivery_index)
-        )
-        routing.solver().Add(
-            distance_dimension.CumulVar(pickup_index)
-            <= distance_dimension.CumulVar(delivery_index)
-        )
-
-
-    # Setting first solution heuristic.
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION
-    )
-
-    # Solve the problem.
-    solution = routing.SolveWithParameters(search_parameters)
-
-    # Print solution on console.
-    if solution:
-        return print_solution(data, manager, routing, solution, cars, customers)
-    return []
-
-
-
+from ortools.constraint_solver import routing_enums_pb2
+from ortools.constraint_solver import pywrapcp
+from utils.distances import ORTOOLS_SCALE, routing_matrix
+
+
+def create_array(cars, customers, matrices=None):
+    # [depot, cars, pickups, dropoffs], blocks already in matrices are reused
+    return routing_matrix(cars, customers, ORTOOLS_SCALE, matrices).tolist()
+
+
+def create_data_model(cars, customers, matrices=None):
+    """Stores the data for the problem."""
+    len_cars = len(cars)
+    len_customers = len(customers)
+
+    data = {}
+
+    #data["distance_matrix"] = [
+         #fmt: off
+     #   [0, 0, 0, 0, 0, 0, 0],
+      #  [0, 0, 100, 5, 10, 2, 2],
+       # [0, 100, 0, 20, 5, 2, 2],
+       # [0, 5, 20, 0, 2, 1, 2],
+       # [0, 10, 5, 1, 0, 2, 1],
+       # [0, 2, 2, 2, 1, 0, 100],
+       # [0, 2, 2, 2, 1, 100, 0]
+        # fmt: on
+    #]
+
+    data["distance_matrix"] = create_array(cars, customers, matrices)
+
+    #data["pickups_deliveries"] = [
+     #   [3, 5],
+      #  [4, 6],
+    #]
+
+    data["pickups_deliveries"] = [
+        [i, i + len_customers] for i in range(1 + len_cars, 1 + len_cars + len_customers)
+    ]
+
+    data["num_vehicles"] = len_cars
+    #data["num_vehicles"] = 2
+
+    data["starts"] = [i for i in range(1, len_cars + 1)]
+    #data["starts"] = [1, 2]
+
+    data["ends"] = [0 for _ in range(len_cars)]
+    #data["ends"] = [0, 0]
+
+    data["vehicle_capacities"] = [1 for _ in range(len_cars)]
+    data["demands"] = [0] + [0 for _ in range(len_cars)] + [1 for _ in range(len_customers)] + [-1 for _ in range(len_customers)]
+
+    return data
+
+
+def extract_routes(data, routing, solution):
+    """
+    Read the routes of a solution.
+
+    :return: per car its routing indices minus the number of cars, see route_plan
+    """
+    route_per_car = []
+    for vehicle_id in range(data["num_vehicles"]):
+        route = []
+        index = routing.Start(vehicle_id)
+        while not routing.IsEnd(index):
+            route.append(index - data["num_vehicles"])
+            index = solution.Value(routing.NextVar(index))
+        route_per_car.append(route)
+
+    return route_per_car
+
+
+def search_parameters(time_limit=None, metaheuristic="GUIDED_LOCAL_SEARCH",
+                      first_solution="PARALLEL_CHEAPEST_INSERTION"):
+    """
+    Routing search parameters for solve.
+
+    :param time_limit: seconds, None stops at the first local optimum without a metaheuristic
+    :param metaheuristic: name of a routing_enums_pb2.LocalSearchMetaheuristic, only used with a time_limit
+        because it does not stop on its own
+    :param first_solution: name of a routing_enums_pb2.FirstSolutionStrategy
+    """
+    parameters = pywrapcp.DefaultRoutingSearchParameters()
+    parameters.first_solution_strategy = getattr(routing_enums_pb2.FirstSolutionStrategy, first_solution)
+    if time_limit is not None:
+        parameters.local_search_metaheuristic = getattr(routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic)
+        parameters.time_limit.FromMilliseconds(max(int(time_limit * 1000), 1))
+
+    return parameters
+
+
+def plan_routes(cars, customers, starts, connections):
+    """
+    Turn starts and connections like schedule's into routing nodes per car, every pickup followed by its
+    delivery, the inverse of route_plan. Cars and customers that are not in the scenario any more, like the
+    ones already served since the plan was made, are skipped.
+    """
+    car_index = {car["id"]: v for v, car in enumerate(cars)}
+    customer_index = {c["id"]: i for i, c in enumerate(customers)}
+    successor = dict(connections)
+    pickup, delivery = 1 + len(cars), 1 + len(cars) + len(customers)
+
+    routes = [[] for _ in cars]
+    for car, customer in starts:
+        if car not in car_index:
+            continue
+
+        route = routes[car_index[car]]
+        for _ in range(len(successor) + 1):
+            if customer is None:
+                break
+            if customer in customer_index:
+                route += [pickup + customer_index[customer], delivery + customer_index[customer]]
+            customer = successor.get(customer)
+
+    return routes
+
+
+def solve(cars, customers, matrices=None, time_limit=None, metaheuristic="GUIDED_LOCAL_SEARCH",
+          first_solution="PARALLEL_CHEAPEST_INSERTION", initial_plan=None):
+    """
+    Solve the pickup and delivery model, see search_parameters for the search.
+
+    Distances and demands are registered as a matrix and a vector, so OR-Tools looks them up in C++ instead
+    of calling back into Python for every arc.
+
+    :param initial_plan: starts, connections to start the local search from instead of a first solution,
+        e.g. the previous dispatch cycle's or schedule's plan. It has to serve every customer, a plan the
+        model cannot read (or one that breaks the distance limit) falls back to first_solution
+    :return: the routes, see extract_routes, [] if there is no solution
+    """
+    data = create_data_model(cars, customers, matrices)
+
+    manager = pywrapcp.RoutingIndexManager(
+        len(data["distance_matrix"]), data["num_vehicles"], data["starts"], data["ends"]
+    )
+    routing = pywrapcp.RoutingModel(manager)
+
+    transit_index = routing.RegisterTransitMatrix(data["distance_matrix"])
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_index)
+
+    demand_index = routing.RegisterUnaryTransitVector(data["demands"])
+    routing.AddDimensionWithVehicleCapacity(
+        demand_index,
+        0,  # null capacity slack
+        data['vehicle_capacities'],  # vehicle maximum capacities
+        True,  # start cumul to zero
+        'Capacity')
+
+    # Add Distance constraint.
+    dimension_name = "Distance"
+    routing.AddDimension(
+        transit_index,
+        0,  # no slack
+        3000,  # vehicle maximum travel distance (in ORTOOLS_SCALE units)
+        True,  # start cumul to zero
+        dimension_name,
+    )
+    distance_dimension = routing.GetDimensionOrDie(dimension_name)
+    distance_dimension.SetGlobalSpanCostCoefficient(100)
+
+    # Define Transportation Requests.
+    for request in data["pickups_deliveries"]:
+        pickup_index = manager.NodeToIndex(request[0])
+        delivery_index = manager.NodeToIndex(request[1])
+        routing.AddPickupAndDelivery(pickup_index, delivery_index)
+        routing.solver().Add(
+            routing.VehicleVar(pickup_index) == routing.VehicleVar(delivery_index)
+        )
+        routing.solver().Add(
+            distance_dimension.CumulVar(pickup_index)
+            <= distance_dimension.CumulVar(delivery_index)
+        )
+
+    parameters = search_parameters(time_limit, metaheuristic, first_solution)
+    start = None
+    if initial_plan is not None:
+        routing.CloseModelWithParameters(parameters)
+        routes = [[manager.NodeToIndex(node) for node in route]
+                  for route in plan_routes(cars, customers, *initial_plan)]
+        start = routing.ReadAssignmentFromRoutes(routes, True)
+
+    if start is not None:
+        solution = routing.SolveFromAssignmentWithParameters(start, parameters)
+    else:
+        solution = routing.SolveWithParameters(parameters)
+    if solution:
+        return extract_routes(data, routing, solution)
+    return []
+
+
+def route_plan(cars, customers, routes):
+    """
+    Turn the routes of solve into starts and connections like schedule.
+
+    A route holds the car's start, then every pickup followed by its delivery, as node - 1 - len(cars)
+    (deliveries are shifted by len(customers)), so the pickups are the entries in range(len(customers)).
+    """
+    starts, connections = [], []
+    for car, route in zip(cars, routes):
+        chain = [customers[i]["id"] for i in route if 0 <= i < len(customers)]
+        if chain:
+            starts.append((car["id"], chain[0]))
+            connections += list(zip(chain, chain[1:]))
+
+    return starts, connections
@@ -0,0 +1,153 @@
+import queue
+import time
+from multiprocessing import TimeoutError
+import pyomo.environ as pyo
+from utils.distances import scenario_matrices
+from utils.evaluate import PlanEvaluator
+from utils.insertion import insertion_plan
+from utils.local_search import improve
+from utils.online import append_nearest, queue_plan
+from utils.scheduler import schedule_within
+from utils.utils import plan_queues, pool_context
+
+ENGINES = ("milp", "ortools", "insertion", "local_search")
+MARGIN = 0.2  # seconds an engine leaves for sending its plan back before the deadline
+
+_incumbents = None
+
+
+def _init_worker(incumbents):
+    # the queue the milp engine streams its incumbents to, a pool only passes it on at start up
+    global _incumbents
+    _incumbents = incumbents
+
+
+def _report(engine, plan):
+    if _incumbents is not None:
+        _incumbents.put((engine, plan["starts"], plan["connections"]))
+
+
+def run_engine(engine, vehicles, customers, radius, options, time_budget, formulation="cuts", matrices=None,
+               vehicle_radius=None):
+    """
+    Plan with one engine of the portfolio, in a worker process.
+
+    "milp" is schedule_within, "ortools" the pickup and delivery model of orfuncs.solve with guided local
+    search, "insertion" is insertion_plan and "local_search" improves that plan for the rest of the budget.
+
+    :param options: HiGHS options, the solver is created in the worker
+    :return: starts, connections, seconds spent
+    """
+    start = time.perf_counter()
+    budget = time_budget - MARGIN
+
+    if engine == "milp":
+        opt = pyo.SolverFactory('appsi_highs')
+        for key, value in options.items():
+            opt.options[key] = value
+        result = schedule_within(vehicles, customers, radius, opt, budget,
+                                 on_incumbent=lambda plan: _report(engine, plan), formulation=formulation,
+                                 matrices=matrices, vehicle_radius=vehicle_radius)
+        starts, connections = result["starts"], result["connections"]
+    elif engine == "ortools":
+        from utils import orfuncs  # only this worker loads OR-Tools
+
+        routes = orfuncs.solve(vehicles, customers, matrices, budget - (time.perf_counter() - start))
+        starts, connections = orfuncs.route_plan(vehicles, customers, routes)
+    else:
+        starts, connections = insertion_plan(vehicles, customers, matrices)
+        if engine == "local_search":
+            starts, connections = improve(vehicles, customers, starts, connections, matrices,
+                                          budget - (time.perf_counter() - start))
+
+    return starts, connections, time.perf_counter() - start
+
+
+def complete_plan(vehicles, customers, starts, connections):
+    # put the customers a plan leaves out behind the chain that ends closest to them
+    tails = plan_queues(starts, connections)
+    queues = {v: [c] + tails.get(v, []) for v, c in starts}
+    served = {c for q in queues.values() for c in q}
+    return queue_plan(append_nearest(queues, [c["id"] for c in customers if c["id"] not in served], vehicles,
+                                     customers))
+
+
+def portfolio(vehicles, customers, radius, opt, time_budget, engines=ENGINES, formulation="cuts", matrices=None,
+              vehicle_radius=None, verbose=False):
+    """
+    Race the planning engines in separate processes and keep the best plan found within time_budget.
+
+    Every engine gets its own process, see run_engine, the MILP gets the cores the others leave. Plans are
+    completed with complete_plan, so a plan that leaves customers out does not win by serving fewer, and
+    scored with PlanEvaluator's cumulative score without simulating. Engines still running at the deadline
+    are terminated, the MILP competes with the last incumbent it streamed, the others lose.
+
+    The OR-Tools wheels bundle a HiGHS that clashes with highspy's, a process can only load one of them.
+    The workers are forked, so call this before the process solves anything with the highs backend, no
+    module in utils loads highspy at import time.
+
+    :param time_budget: seconds until the winner is returned
+    :return: dict with the winning "engine", its "starts", "connections" and "score", and "scores" with
+        the score of every engine, None for the ones that failed or ran out of time
+    """
+    deadline = time.perf_counter() + time_budget
+    if matrices is None:
+        matrices = scenario_matrices(vehicles, customers, dropoff_pickup=False)
+
+    options = dict(opt.options)
+    context, options["threads"] = pool_context(len(engines), solvers=1)
+
+    evaluator = PlanEvaluator(vehicles, customers)
+    results, streamed = {}, {}
+    incumbents = context.Queue()
+    pool = context.Pool(len(engines), _init_worker, (incumbents,))
+    try:
+        pending = {engine: pool.apply_async(run_engine, (engine, vehicles, customers, radius, options,
+                                                         deadline - time.perf_counter(), formulation, matrices,
+                                                         vehicle_radius))
+                   for engine in engines}
+        for engine, result in pending.items():
+            try:
+                starts, connections, seconds = result.get(max(deadline - time.perf_counter(), 0))
+                results[engine] = starts, connections
+                if verbose:
+                    print(f"{engine}: done in {seconds:.2f}s")
+            except TimeoutError:
+                if verbose:
+                    print(f"{engine} ran out of time")
+            except Exception as e:
+                if verbose:
+                    print(f"{engine} failed ({e})")
+
+        # read before terminating, a worker killed while writing would leave half a message
+        while True:
+            try:
+                engine, starts, connections = incumbents.get_nowait()
+            except queue.Empty:
+                break
+            streamed[engine] = starts, connections
+    finally:
+        pool.terminate()
+
+    # the last plan an engine streamed stands in for the result it did not deliver in time
+    scores, plans = {}, {}
+    for engine in engines:
+        plan = results.get(engine) or streamed.get(engine)
+        if plan is None:
+            scores[engine] = None
+            continue
+
+        plans[engine] = complete_plan(vehicles, customers, *plan)
+        scores[engine] = evaluator.score(*plans[engine])
+        if verbose:
+            print(f"{engine}: score {scores[engine]:.0f}" + ("" if engine in results else " (last incumbent)"))
+
+    if not plans:
+        # every engine failed, insertion_plan takes a fraction of a second
+        plans["insertion"] = insertion_plan(vehicles, customers, matrices)
+        scores["insertion"] = evaluator.score(*plans["insertion"])
+
+    engine = min(plans, key=scores.get)
+    starts, connections = plans[engine]
+    return {"engine": engine, "starts": starts, "connections": connections, "score": scores[engine],
+            "scores": scores}
@@ -0,0 +1,185 @@
+import math
+from collections import deque
+
+
+def predecessors_matching(graph):
+    """
+    Maximum matching of customers to a predecessor (Hopcroft-Karp).
+
+    Every customer has to be picked up after exactly one predecessor, either a vehicle or a customer along
+    one of its candidate arcs, and every predecessor serves at most one customer. A customer that is left
+    unmatched in a maximum matching cannot be served without a joker.
+
+    :return: dict customer id -> predecessor id (customer or vehicle)
+    """
+    # left nodes: customers and vehicles as predecessors, right nodes: customers
+    left = graph.customer_ids + graph.vehicle_ids
+    vehicles = set(graph.vehicle_ids)
+
+    def neighbours(p):
+        return graph.vehicle_arcs[p].keys() if p in vehicles else graph.successors(p)
+
+    match_left = {p: None for p in left}
+    match_right = {c: None for c in graph.customer_ids}
+
+    # greedy start, keeps the number of phases small
+    for p in left:
+        for c in neighbours(p):
+            if match_right[c] is None:
+                match_left[p], match_right[c] = c, p
+                break
+
+    while True:
+        # bfs from free predecessors, layering the left nodes
+        dist = {}
+        queue = deque()
+        for p in left:
+            if match_left[p] is None:
+                dist[p] = 0
+                queue.append(p)
+
+        found = False
+        while queue:
+            p = queue.popleft()
+            for c in neighbours(p):
+                q = match_right[c]
+                if q is None:
+                    found = True
+                elif q not in dist:
+                    dist[q] = dist[p] + 1
+                    queue.append(q)
+
+        if not found:
+            break
+
+        # dfs along the layers, iterative so long augmenting paths do not hit the recursion limit
+        for root in [p for p in left if match_left[p] is None]:
+            stack = [(root, iter(neighbours(root)))]
+            path = []
+            while stack:
+                p, it = stack[-1]
+                advanced = False
+                for c in it:
+                    q = match_right[c]
+                    if q is None:
+                        path.append((p, c))
+                        for pp, cc in path:
+                            match_left[pp], match_right[cc] = cc, pp
+                        stack = []
+                        advanced = True
+                        break
+                    if dist.get(q) == dist[p] + 1:
+                        path.append((p, c))
+                        stack.append((q, iter(neighbours(q))))
+                        advanced = True
+                        break
+
+                if not advanced:
+                    # dead end, never visit p again in this phase
+                    dist[p] = None
+                    stack.pop()
+                    if path:
+                        path.pop()
+
+    return {c: p for c, p in match_right.items() if p is not None}
+
+
+def presolve_exceptions(graph):
+    """
+    Predict the customers that would come back with a joker and make them exceptions before the first solve.
+
+    Customers left without a predecessor by predecessors_matching become full exceptions, the same widening
+    the joker retry in schedule does after a solve. Cycles are not checked here, so the retry stays as a
+    fallback.
+
+    The matching does not know which customers the solver would rather leave to a joker, so the plan can be
+    worse than the one the retry ends with, and partial exceptions (arcs from only the nearest customers)
+    make it much worse: "cuts" only has waiting_time_chained rows for arcs with a reverse, one-way arcs
+    chain customers for free. schedule only presolves on request.
+
+    :param graph: CandidateGraph, widened in place
+    :return: the customers that became exceptions
+    """
+    matching = predecessors_matching(graph)
+    unmatched = [c for c in graph.customer_ids if c not in matching and c not in graph.exceptions]
+    for c in unmatched:
+        graph.add_exception(c)
+
+    return unmatched
+
+
+def forced_jokers(graph):
+    # customers without any predecessor, not even a vehicle, can only be served by a joker
+    return {c for c in graph.customer_ids if not graph.in_arcs[c] and not graph.vehicle_in_arcs[c]}
+
+
+def waiting_time_bounds(graph, formulation="cuts"):
+    """
+    Upper bound on each customer's waiting time in an optimal plan.
+
+    Every value is positive, so the objective pushes each waiting time down to the longest chain of
+    waiting_time_chained rows in front of the customer: the vehicle's way to the first pickup, then per
+    customer its trip and the arc to the next pickup. Such a chain stays within one connected component of
+    the chained arcs (CandidateGraph.chained) and holds at most size - 2
+    customers besides the direct predecessor, so the longest vehicle arc into the component, its size - 2
+    longest steps and the longest step into the customer bound it. Waiting times are integers, so the
+    distances are rounded up.
+
+    Adding arcs can only raise the bounds, recompute them after add_exception.
+
+    :return: dict customer id -> bound
+    """
+    trip = graph.trip_distances()
+    forced = forced_jokers(graph)
+
+    # a customer that has to take a joker ends its chain, nothing follows it
+    chained = {c: {c2: d for c2, d in graph.out_arcs[c].items() if graph.chained(c, c2, formulation)}
+               if c not in forced else {} for c in graph.customer_ids}
+    neighbours = {c: set(out) for c, out in chained.items()}
+    for c1, out in chained.items():
+        for c2 in out:
+            neighbours[c2].add(c1)
+
+    start = {c: max((math.ceil(d) for d in graph.vehicle_in_arcs[c].values()), default=0) for c in graph.customer_ids}
+
+    bounds = {}
+    seen = set()
+    for root in graph.customer_ids:
+        if root in seen:
+            continue
+
+        component, stack = [], [root]
+        seen.add(root)
+        while stack:
+            c = stack.pop()
+            component.append(c)
+            for c2 in neighbours[c] - seen:
+                seen.add(c2)
+                stack.append(c2)
+
+        steps = sorted((math.ceil(trip[c] + max(chained[c].values())) for c in component if chained[c]), reverse=True)
+        front = max(start[c] for c in component) + sum(steps[:max(len(component) - 2, 0)])
+
+        for c in component:
+            last = max((math.ceil(trip[p] + chained[p][c]) for p in graph.in_arcs[c] if c in chained[p]), default=None)
+            bounds[c] = start[c] if last is None else max(start[c], front + last)
+
+    return bounds
+
+
+def reductions(graph):
+    """
+    Count what the vehicle radius and the bounds remove from the full model, see build_model.
+
+    :return: dict with the dropped vehicle_customer variables, the variables fixed by forced_jokers and the
+        vehicle_max_connection and waiting_time_start rows left out because they only bound a single variable
+    """
+    forced = forced_jokers(graph)
+    vehicle_pairs = sum(len(out) for out in graph.vehicle_arcs.values())
+
+    return {
+        "dropped_vehicle_pairs": len(graph.vehicle_ids) * len(graph.customer_ids) - vehicle_pairs,
+        "fixed_variables": sum(2 + len(graph.out_arcs[c]) for c in forced),
+        "removed_rows": sum(len(out) <= 1 for out in graph.vehicle_arcs.values()) +
+                        sum(not vin for vin in graph.vehicle_in_arcs.values()),
+    }
@@ -0,0 +1,492 @@
+import math
+import time
+import pyomo.environ as pyo
+from utils.distances import coordinates, haversine, scenario_matrices
+from utils.graph import CandidateGraph, plan_cycles
+from utils.presolve import forced_jokers, presolve_exceptions, reductions, waiting_time_bounds
+
+FORMULATIONS = ("cuts", "chain")
+MODEL_FACTOR = 3  # building a HighsScheduler takes up to this many times its CandidateGraph
+
+
+def _value(x):
+    if x < 0:
+        raise ValueError("x cannot be negative")
+
+    return max(200 + 1/10 * x + 1/40 * (1/50 * x)**2, 2000)
+
+
+def calculate_score(wait_times, distances_dict):
+    score = 0
+    for id, t in wait_times.items():
+            score += _value(distances_dict[id]) * t
+
+    return score
+
+
+def customer_distances(customers, matrices=None):
+    # distance between src and dest for each customer, which decides its value
+    if matrices is None:
+        _, pickups, dropoffs = coordinates([], customers)
+        trip = haversine(pickups[:, 0], pickups[:, 1], dropoffs[:, 0], dropoffs[:, 1])
+    else:
+        trip = matrices["pickup_dropoff"]
+
+    return {c["id"]: float(d) for c, d in zip(customers, trip)}
+
+
+def scenario_data(graph):
+    """
+    Collect everything the Scheduler model needs from a CandidateGraph.
+
+    :return: dict with ids, valid pairs and distances keyed by ids
+    """
+    trip_distances = graph.trip_distances()
+
+    return {
+        "graph": graph,
+        "customer_ids": graph.customer_ids,
+        "vehicle_ids": graph.vehicle_ids,
+        "valid_pairs": graph.arcs(),
+        "vehicle_pairs": graph.vehicle_pairs(),
+        "customer_distances": trip_distances,
+        "customer_pair_distances": graph.pair_distances(),
+        "vehicle_customer_distances": graph.vehicle_distances(),
+        "customer_values": {cid: _value(d) for cid, d in trip_distances.items()},
+    }
+
+
+def vehicle_max_connection(model, vehicle):
+    # with a single candidate customer the row only repeats the variable's bound
+    if len(model.graph.vehicle_arcs[vehicle]) <= 1:
+        return pyo.Constraint.Skip
+
+    return sum(model.vehicle_customer[vehicle, customer] for customer in model.graph.vehicle_arcs[vehicle]) <= 1
+
+
+def customer_max_connection(model, customer1):
+    return (sum(
+        model.customer_customer[customer1, customer2] for customer2 in model.graph.successors(customer1))
+            <= 1 - model.joker[customer1])
+
+
+def gets_picked_up_once(model, customer1):
+    return (sum(
+        model.customer_customer[customer2, customer1] for customer2 in model.graph.predecessors(customer1)) +
+            sum(model.vehicle_customer[vehicle, customer1] for vehicle in model.graph.vehicle_in_arcs[customer1]) +
+            model.joker[customer1]) == 1
+
+
+def waiting_time_chained(model, customer1, customer2):
+    # per arc big-M: for x = 0 the row has to hold for any w1 up to its bound and w2 >= 0
+    big_m = (model.waiting_time_bound[customer1] + model.customer_destination_distance[customer1] +
+             model.next_customer_distance[customer1, customer2])
+    return (model.waiting_time[customer1] + model.customer_destination_distance[customer1] +
+            model.next_customer_distance[customer1, customer2]) <= model.waiting_time[customer2] + (1 - model.customer_customer[customer1, customer2]) * big_m
+
+
+def waiting_time_start(model, customer):
+    # without a vehicle arc the row would only say w >= 0
+    if not model.graph.vehicle_in_arcs[customer]:
+        return pyo.Constraint.Skip
+
+    return (sum(model.vehicle_customer[vehicle, customer]
+                * model.vehicle_customer_distance[vehicle, customer] for vehicle in model.graph.vehicle_in_arcs[customer])) <= \
+        model.waiting_time[customer]
+
+
+def subset_elimination(model, subset):
+    return sum(sum(model.customer_customer[customer1, customer2] for customer2 in subset if model.graph.has_arc(customer1, customer2))
+               for customer1 in subset) <= len(subset) - 1
+
+
+def loss(model):
+    return sum(model.value_function[customer] * model.waiting_time[customer] +
+               model.value_function[customer] * model.joker[customer] * 10000 for customer in model.customers)
+
+
+def build_model(model, data, formulation="cuts"):
+    """
+    Add the Scheduler sets, params, variables, constraints and objective to a ConcreteModel.
+
+    "cuts" only chains waiting times for pairs that are valid in both directions and for the arcs of a
+    start plan (CandidateGraph.add_plan), and leaves subset elimination to solve_with_cuts. "chain" chains the waiting time over every valid pair,
+    which orders customers along each chain and rules out cycles with O(n^2) rows, since every
+    trip has a positive length.
+
+    Waiting times are bounded by waiting_time_bounds, which also gives every waiting_time_chained row its
+    own big-M. Only the graph's vehicle arcs get a vehicle_customer variable, and customers that can only
+    take a joker are fixed, see presolve.reductions.
+    """
+    if formulation not in FORMULATIONS:
+        raise ValueError(f"unknown formulation {formulation}, expected one of {FORMULATIONS}")
+
+    # plain attributes, the rules walk the graph adjacency instead of scanning all customers
+    model.graph = data["graph"]
+    model.formulation = formulation
+
+    model.customers = pyo.Set(initialize=data["customer_ids"], doc="customers")
+    model.vehicles = pyo.Set(initialize=data["vehicle_ids"], doc="vehicles")
+    model.valid_pairs = pyo.Set(dimen=2, initialize=data["valid_pairs"], doc="valid pairs")
+    model.vehicle_pairs = pyo.Set(dimen=2, initialize=data["vehicle_pairs"], doc="vehicle pairs")
+
+    model.customer_destination_distance = pyo.Param(model.customers, initialize=data["customer_distances"],
+                                                    doc="cd_d")  # dist pickup -> dest
+    model.next_customer_distance = pyo.Param(model.valid_pairs, initialize=data["customer_pair_distances"],
+                                             mutable=True, doc="nc_d")  # dist between each customer
+    model.vehicle_customer_distance = pyo.Param(model.vehicle_pairs,
+                                                initialize=data["vehicle_customer_distances"],
+                                                doc="vc_d")  # dist between each vehicle & customer
+    model.value_function = pyo.Param(model.customers, initialize=data["customer_values"],
+                                     doc="v")  # some value based on customer path length (n log n)
+    model.waiting_time_bound = pyo.Param(model.customers, initialize=waiting_time_bounds(model.graph, formulation),
+                                         mutable=True, doc="w_ub")  # grows with the arcs add_exceptions adds
+
+    model.customer_customer = pyo.Var(model.valid_pairs, within=pyo.Binary, doc="x_cc")
+    model.vehicle_customer = pyo.Var(model.vehicle_pairs, within=pyo.Binary, doc="x_vc")
+    model.waiting_time = pyo.Var(model.customers, within=pyo.NonNegativeIntegers,
+                                 bounds=lambda model, c: (0, model.waiting_time_bound[c]), doc="w")
+    model.joker = pyo.Var(model.customers, within=pyo.Binary, doc="j")
+
+    model.vehicle_max_connection = pyo.Constraint(model.vehicles, rule=vehicle_max_connection, doc="v_max")
+
+    model.customer_max_connection = pyo.Constraint(model.customers, rule=customer_max_connection, doc="c_max")
+
+    model.gets_picked_up_once = pyo.Constraint(model.customers, rule=gets_picked_up_once, doc="pickup")
+
+    model.waiting_time_chained = pyo.ConstraintList()
+
+    for c1, c2 in model.valid_pairs:
+        if model.graph.chained(c1, c2, formulation):
+            model.waiting_time_chained.add(waiting_time_chained(model, c1, c2))
+
+    model.waiting_time_start = pyo.Constraint(model.customers, rule=waiting_time_start, doc="wt_s")
+
+    # filled lazily by solve_with_cuts, one row per cycle found in a solution
+    model.subset_elimination_constraints = pyo.ConstraintList()
+
+    model.loss = pyo.Objective(rule=loss, sense=pyo.minimize, doc="loss")
+
+    fix_forced_jokers(model)
+
+
+def fix_forced_jokers(model):
+    # a customer without any predecessor takes its joker, which leaves no room for its out arcs.
+    # add_exceptions can give it a predecessor later, then the fix is undone
+    forced = forced_jokers(model.graph)
+    for c in model.customers:
+        if c in forced:
+            model.joker[c].fix(1)
+            for c2 in model.graph.successors(c):
+                model.customer_customer[c, c2].fix(0)
+        elif model.joker[c].fixed:
+            model.joker[c].unfix()
+            for c2 in model.graph.successors(c):
+                model.customer_customer[c, c2].unfix()
+
+
+def chained_pairs(graph, new_arcs, formulation):
+    # waiting_time_chained rows that new arcs unlock: the new arcs themselves and,
+    # for "cuts", old arcs that just got their reverse (plan arcs have their row already)
+    pairs = []
+    for c1, c2 in new_arcs:
+        if graph.chained(c1, c2, formulation):
+            pairs.append((c1, c2))
+        if (formulation == "cuts" and graph.has_arc(c2, c1) and (c2, c1) not in new_arcs
+                and (c2, c1) not in graph.plan_arcs):
+            pairs.append((c2, c1))
+
+    return pairs
+
+
+def add_exceptions(model, customers):
+    """
+    Make customers reachable from every other customer on a built model.
+
+    Only the new arcs, their waiting_time_chained rows and the rows the arcs appear in are touched, so a
+    persistent solver like appsi_highs only sends those changes to the solver on the next solve.
+    """
+    new_arcs = set()
+    for c in customers:
+        new_arcs.update(model.graph.add_exception(c))
+
+    for c1, c2 in sorted(new_arcs):
+        model.valid_pairs.add((c1, c2))
+        model.next_customer_distance[c1, c2] = model.graph.out_arcs[c1][c2]
+
+    for c1 in {c1 for c1, _ in new_arcs}:
+        model.customer_max_connection[c1].set_value(customer_max_connection(model, c1))
+
+    for c2 in {c2 for _, c2 in new_arcs}:
+        model.gets_picked_up_once[c2].set_value(gets_picked_up_once(model, c2))
+
+    for c1, c2 in chained_pairs(model.graph, new_arcs, model.formulation):
+        model.waiting_time_chained.add(waiting_time_chained(model, c1, c2))
+
+    # longer arcs raise the waiting time bounds and with them every big-M
+    for c, bound in waiting_time_bounds(model.graph, model.formulation).items():
+        model.waiting_time_bound[c] = bound
+    fix_forced_jokers(model)
+
+    return new_arcs
+
+
+def find_cycles(model):
+    return plan_cycles(extract_plan(model)[1])
+
+
+def solve_with_cuts(model, opt):
+    # solve without subset elimination, then only add the rows that cut off the cycles we actually found
+    while True:
+        result = opt.solve(model)
+        cycles = find_cycles(model)
+
+        if not cycles:
+            return result
+
+        for cycle in cycles:
+            model.subset_elimination_constraints.add(subset_elimination(model, cycle))
+
+
+def jokers(model):
+    return [c for c in model.customers if math.isclose(model.joker[c].value or 0, 1, rel_tol=1e-6)]
+
+
+def extract_plan(model):
+    connections = []
+    starts = []
+    for pair in model.valid_pairs:
+        if math.isclose(model.customer_customer[pair].value or 0, 1, rel_tol=1e-6):
+            connections.append(pair)
+
+    for pair in model.vehicle_pairs:
+        if math.isclose(model.vehicle_customer[pair].value or 0, 1, rel_tol=1e-6):
+            starts.append(pair)
+
+    return starts, connections
+
+
+def schedule(vehicles, customers, radius, opt, formulation="cuts", exceptions=None, matrices=None, backend="pyomo",
+             presolve=False, vehicle_radius=None, warm_start=False, verbose=False):
+    """
+    Build and solve the Scheduler until no customer needs a joker.
+
+    Customers that come back with a joker are added to exceptions, which makes them reachable from
+    every other customer, and the same model is solved again with the arcs that unlocks.
+
+    :param backend: "pyomo" solves with opt, "highs" passes the same model as arrays to highspy
+        with opt.options as HiGHS options
+    :param presolve: widen the customers presolve_exceptions predicts to need a joker before the first solve,
+        saves the retry but can give a worse plan, see there
+    :param vehicle_radius: only give vehicles the pickups within this many meters (and their nearest one),
+        None keeps every vehicle -> customer pair
+    :param warm_start: start the highs backend from the insertion_plan heuristic, its arcs are added to the
+        graph so the start is feasible and HiGHS only has to improve on it. The start is returned instead
+        when PlanEvaluator scores it better, like schedule_within ranks its plans, and loaded into the model
+        as its solution (HighsScheduler.set_start)
+    :param verbose: print what presolve removed and the exceptions of every retry
+    :return: model, starts, connections, exceptions
+    """
+    graph = CandidateGraph(vehicles, customers, radius, matrices, vehicle_radius)
+    for c in exceptions or []:
+        graph.add_exception(c)
+
+    if presolve:
+        presolve_exceptions(graph)
+
+    start = None
+    if warm_start and backend == "highs":
+        from utils.insertion import insertion_plan  # imports this module
+
+        start = insertion_plan(vehicles, customers, graph.matrices)
+        graph.add_plan(*start)
+
+    if verbose:
+        reduced = reductions(graph)
+        # without a vehicle radius every vehicle -> customer pair is kept
+        dropped = ""
+        if vehicle_radius is not None:
+            dropped = f"dropped {reduced['dropped_vehicle_pairs']} vehicle -> customer variables, "
+        print(f"presolve: {dropped}fixed {reduced['fixed_variables']} variables, "
+              f"removed {reduced['removed_rows']} rows")
+
+    if backend == "highs":
+        from utils.highs_backend import HighsScheduler  # imports this module
+
+        model = HighsScheduler(graph, formulation, dict(opt.options))
+        if start is not None:
+            model.set_start(*start)
+    else:
+        model = pyo.ConcreteModel(name="Scheduler")
+        build_model(model, scenario_data(graph), formulation)
+
+    # the model is kept between retries, new exceptions only add their arcs and rows
+    while True:
+        if backend == "highs":
+            model.solve_with_cuts()
+            new_exceptions = model.jokers()
+        else:
+            solve_with_cuts(model, opt)
+            new_exceptions = jokers(model)
+
+        new_exceptions = [c for c in new_exceptions if c not in graph.exceptions]
+        if not new_exceptions:
+            break
+
+        if verbose:
+            print(f"retry with exceptions: {[c[:6] for c in new_exceptions]}")
+        if backend == "highs":
+            model.add_exceptions(new_exceptions)
+        else:
+            add_exceptions(model, new_exceptions)
+
+    starts, connections = model.extract_plan() if backend == "highs" else extract_plan(model)
+    if start is not None:
+        from utils.evaluate import PlanEvaluator  # imports this module
+        from utils.highs_backend import JOKER_PENALTY
+
+        evaluator = PlanEvaluator(vehicles, customers)
+        if (evaluator.score(*start, joker_penalty=JOKER_PENALTY)
+                < evaluator.score(starts, connections, joker_penalty=JOKER_PENALTY)):
+            model.set_start(*start, load=True)
+            starts, connections = model.extract_plan()
+
+    return model, starts, connections, list(graph.exceptions)
+
+
+def _gap(objective, bound):
+    # relative gap like HiGHS's mip_gap
+    if objective == bound:
+        return 0.0
+    return abs(objective - bound) / abs(objective) if objective else math.inf
+
+
+def schedule_within(vehicles, customers, radius, opt, time_budget, mip_gap=None, on_incumbent=None,
+                    formulation="cuts", exceptions=None, matrices=None, vehicle_radius=None, presolve=False,
+                    verbose=False):
+    """
+    schedule with the highs backend under a wall-clock budget, returning the best plan found so far.
+
+    insertion_plan is the fallback and comes first, so there is a plan within milliseconds whatever happens
+    afterwards. The deadline is checked before building the graph and the model, once there is no time
+    left for them the fallback is returned as it is. The fallback is also the start of the first
+    solve, its arcs are added to the graph like with warm_start and chained for every formulation
+    (CandidateGraph.chained), so "cuts" cannot chain customers over them for free. Every solve of the cut and
+    exception rounds only gets the time that is left, see HighsScheduler.set_deadline, and stops early once
+    the incumbent is within mip_gap of the bound. A round is only started if the last one would still fit
+    before the deadline. After a round that found cycles the best plan so far is passed back as the start.
+
+    Plans are ranked by PlanEvaluator's cumulative score, customers left to a joker charged like in the
+    loss, not by the model objective: "cuts" only charges the waits along arcs with a reverse, so its
+    optimum can chain customers onto one vehicle that the fallback spreads over the fleet.
+
+    :param time_budget: seconds for everything, building the graph and the model included. The model is only
+        built if MODEL_FACTOR times the graph's time is left and a solve returns at the deadline even when
+        HiGHS is in a step it cannot be interrupted in, see HighsScheduler.solve. What can overrun the budget
+        is the insertion plan, which always comes first, the graph build and INTERRUPT_LATENCY
+    :param mip_gap: relative gap at which a solve counts as done, HiGHS's mip_rel_gap
+    :param on_incumbent: called with a dict like the result (starts, connections, score, objective, bound,
+        gap) for the fallback and every plan HiGHS finds that improves the score, from HiGHS's thread
+    :param presolve: see schedule
+    :param verbose: print the exceptions of every retry
+    :return: dict with the best "starts", "connections", their "score" and model "objective", the "bound"
+        and "gap" of the last solve, "complete" when the rounds finished (no cycles, no new jokers) before
+        the deadline, the "model" and the "exceptions". Without time for the model "objective" is nan and
+        "model" None, call model.wait() before using a model whose last solve was given up at the deadline
+    """
+    import highspy
+    from utils.evaluate import PlanEvaluator  # imports this module
+    from utils.highs_backend import JOKER_PENALTY, HighsScheduler  # imports this module
+    from utils.insertion import insertion_plan  # imports this module
+
+    deadline = time.perf_counter() + time_budget
+    if matrices is None:
+        matrices = scenario_matrices(vehicles, customers, dropoff_pickup=False)
+    starts, connections = insertion_plan(vehicles, customers, matrices)
+
+    evaluator = PlanEvaluator(vehicles, customers)
+    best = {"starts": starts, "connections": connections,
+            "score": evaluator.score(starts, connections, joker_penalty=JOKER_PENALTY),
+            "objective": math.nan, "bound": -math.inf, "gap": math.inf}
+    if on_incumbent:
+        on_incumbent(dict(best))
+
+    def fallback():
+        return dict(best, complete=False, model=None, exceptions=list(exceptions or []))
+
+    if time.perf_counter() >= deadline:
+        return fallback()
+
+    graph_start = time.perf_counter()
+    graph = CandidateGraph(vehicles, customers, radius, matrices, vehicle_radius)
+    for c in exceptions or []:
+        graph.add_exception(c)
+    if presolve:
+        presolve_exceptions(graph)
+    graph.add_plan(starts, connections)
+    if time.perf_counter() + MODEL_FACTOR * (time.perf_counter() - graph_start) >= deadline:
+        return fallback()
+
+    options = dict(opt.options)
+    if mip_gap is not None:
+        options["mip_rel_gap"] = mip_gap
+    model = HighsScheduler(graph, formulation, options)
+    best["objective"] = model.set_start(starts, connections)
+
+    def improving(plan):
+        # HiGHS reports the start again at the beginning of every round, that does not improve the score.
+        # A solve given up at the deadline can still report plans, they come too late
+        if time.perf_counter() > deadline:
+            return
+        score = evaluator.score(plan["starts"], plan["connections"], joker_penalty=JOKER_PENALTY)
+        if score < best["score"] and not math.isclose(score, best["score"]):
+            best.update(plan, score=score)
+            if on_incumbent:
+                on_incumbent(dict(best))
+
+    model.on_incumbent(improving)
+
+    complete = False
+    last_round = 0.0
+    while True:
+        # a solve cannot be interrupted before its root setup is done
+        if time.perf_counter() + max(last_round, model.setup_seconds) >= deadline:
+            break
+        model.set_deadline(deadline)
+
+        round_start = time.perf_counter()
+        status = model.solve()
+        last_round = time.perf_counter() - round_start
+        if status is None:
+            # HiGHS is still in a step without interrupt checks, it stops on its own
+            break
+        best["bound"] = model.bound()
+        if not model.feasible():
+            break
+
+        starts, connections = model.extract_plan()
+        cycles = plan_cycles(connections)
+        if not cycles:
+            improving({"starts": starts, "connections": connections, "objective": model.objective(),
+                       "bound": model.bound(), "gap": model.gap()})
+
+        if status != highspy.HighsModelStatus.kOptimal:
+            break
+
+        if cycles:
+            for cycle in cycles:
+                model.add_subset_elimination(cycle)
+            model.set_start(best["starts"], best["connections"])
+            continue
+
+        new_exceptions = [c for c in model.jokers() if c not in graph.exceptions]
+        if not new_exceptions:
+            complete = True
+            break
+
+        if verbose:
+            print(f"retry with exceptions: {[c[:6] for c in new_exceptions]}")
+        model.add_exceptions(new_exceptions)
+
+    best["gap"] = _gap(best["objective"], best["bound"])
+    return dict(best, complete=complete, model=model, exceptions=list(graph.exceptions))
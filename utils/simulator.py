@@ -0,0 +1,135 @@
+import asyncio
+import copy
+import math
+import threading
+from utils.distances import VEHICLE_SPEED, haversine
+from utils.utils import random_scenario
+
+
+class VirtualClock:
+    """
+    Wall seconds of one simulated scenario. Sleeping only moves the clock forward, it returns at once.
+    """
+
+    def __init__(self):
+        self.time = 0.0
+
+    def monotonic(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.time += max(seconds, 0)
+
+    async def wait(self, seconds):
+        self.sleep(seconds)
+        # let the other fleets in the event loop run, like a real sleep would
+        await asyncio.sleep(0)
+
+
+class Simulator:
+    """
+    In-process stand-in for the scenario service (8080) and the runner (8090), with the calls of ScenarioClient.
+
+    Scenarios come from random_scenario. Every scenario runs on its own VirtualClock, the dispatch loops take
+    it from clock(scenario_id), so a simulation takes as long as its events need to compute, not as long as
+    the vehicles need to drive. After launch_scenario, a simulation second is speed clock seconds, like
+    the runner.
+
+    An assigned vehicle drives to the pickup and then to the destination in a straight line at
+    vehicle_speed, both legs rounded to whole seconds. get_scenario reports the remaining time of the current
+    leg as remainingTravelTime, None once the vehicle is free again.
+    """
+
+    def __init__(self, seed=0, vehicle_speed=VEHICLE_SPEED):
+        self.seed = seed
+        self.vehicle_speed = vehicle_speed
+        self.scenarios = {}
+        self.clocks = {}
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def clock(self, scenario_id):
+        return self.clocks[scenario_id]
+
+    def _now(self, scenario):
+        # simulation seconds since launch
+        if scenario["launched_at"] is None:
+            return 0
+        return (self.clocks[scenario["id"]].monotonic() - scenario["launched_at"]) / scenario["speed"]
+
+    def _leg(self, lat1, lon1, lat2, lon2):
+        return round(float(haversine(lat1, lon1, lat2, lon2)) / self.vehicle_speed)
+
+    def create_scenario(self, amount_v, amount_c):
+        with self._lock:
+            seed = self.seed + self._created
+            self._created += 1
+
+        scenario = random_scenario(amount_v, amount_c, seed)
+        scenario["id"] = f"sim-{seed}"
+        for v in scenario["vehicles"]:
+            v.update(customerId=None, remainingTravelTime=None)
+
+        return copy.deepcopy(scenario)
+
+    def initialize_scenario(self, scenario):
+        state = copy.deepcopy(scenario)
+        state.update(speed=1, launched_at=None, trips={},
+                     vehicle_by_id={v["id"]: v for v in state["vehicles"]},
+                     customer_by_id={c["id"]: c for c in state["customers"]})
+        self.scenarios[state["id"]] = state
+        self.clocks[state["id"]] = VirtualClock()
+        return {"scenario": scenario}
+
+    def launch_scenario(self, scenario_id, speed):
+        scenario = self.scenarios[scenario_id]
+        scenario["speed"] = speed
+        scenario["launched_at"] = self.clocks[scenario_id].monotonic()
+
+    def update_scenario(self, scenario_id, vehicles):
+        scenario = self.scenarios[scenario_id]
+        now = self._now(scenario)
+        self._advance(scenario, now)
+
+        updated = []
+        for assignment in vehicles:
+            vehicle = scenario["vehicle_by_id"][assignment["id"]]
+            customer = scenario["customer_by_id"][assignment["customerId"]]
+            if vehicle["id"] in scenario["trips"]:
+                raise ValueError(f"vehicle {vehicle['id']} is still serving {vehicle['customerId']}")
+            if not customer["awaitingService"]:
+                raise ValueError(f"customer {customer['id']} was already assigned")
+
+            eta = self._leg(vehicle["coordX"], vehicle["coordY"], customer["coordX"], customer["coordY"])
+            pickup = now + eta
+            dropoff = pickup + self._leg(customer["coordX"], customer["coordY"],
+                                         customer["destinationX"], customer["destinationY"])
+            scenario["trips"][vehicle["id"]] = (customer["id"], pickup, dropoff)
+            customer["awaitingService"] = False
+            vehicle["customerId"] = customer["id"]
+
+            updated.append({"id": vehicle["id"], "customerId": customer["id"], "remainingTravelTime": eta})
+
+        return {"updatedVehicles": updated}
+
+    def _advance(self, scenario, now):
+        # finish the trips that are over by now and set the remaining time of the others
+        for vehicle_id, (customer_id, pickup, dropoff) in list(scenario["trips"].items()):
+            vehicle = scenario["vehicle_by_id"][vehicle_id]
+            if now >= dropoff:
+                customer = scenario["customer_by_id"][customer_id]
+                vehicle.update(coordX=customer["destinationX"], coordY=customer["destinationY"], customerId=None,
+                               remainingTravelTime=None)
+                del scenario["trips"][vehicle_id]
+            else:
+                vehicle["remainingTravelTime"] = math.ceil((pickup if now < pickup else dropoff) - now)
+
+    def get_scenario(self, scenario_id):
+        scenario = self.scenarios[scenario_id]
+        self._advance(scenario, self._now(scenario))
+        return {"id": scenario_id, "vehicles": copy.deepcopy(scenario["vehicles"]),
+                "customers": copy.deepcopy(scenario["customers"])}
+
+    def latency_report(self):
+        # nothing goes over the network
+        return {}
@@ -0,0 +1,148 @@
+import numpy as np
+from utils.distances import EARTH_RADIUS, haversine
+
+METERS_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+
+
+class GridIndex:
+    """
+    Uniform grid over (lat, lon) points for radius queries.
+
+    Points are projected to meters around the mean latitude and bucketed into square cells of at least
+    the query radius, so a query only looks at the cells around each query point and then filters the
+    candidates with the exact haversine distance.
+
+    The projection keeps the east-west scale of the mean latitude, so it overstates east-west distances
+    closer to the pole by cos(lat0) / cos(lat). Cells are stretched by that factor over the indexed
+    latitudes, and a query looks at as many rings of cells as its radius needs at the latitudes involved,
+    or at every point when that is fewer.
+    """
+
+    def __init__(self, points, cell_size):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.lat0 = float(np.mean(self.points[:, 0])) if len(self.points) else 0.0
+        self.cell_size = max(float(cell_size), 1.0) * self._stretch(self.points)
+
+        cells = self._cells(self.points)
+        self._offset = cells.min(axis=0) - 1 if len(cells) else np.zeros(2, dtype=np.int64)
+        self._width = (cells[:, 1].max() - self._offset[1] + 2) if len(cells) else 1
+
+        keys = self._keys(cells)
+        self._order = np.argsort(keys, kind="stable")
+        self._sorted_keys = keys[self._order]
+
+    def _stretch(self, points):
+        # how much the projection can overstate the distance between a point and an indexed one, the 1 %
+        # covers the curvature the flat projection ignores
+        lats = np.abs(np.concatenate([points[:, 0], self.points[:, 0]]))
+        if not len(lats):
+            return 1.01
+        far = np.radians(min(float(lats.max()), 89.0))
+        return 1.01 * max(np.cos(np.radians(self.lat0)) / np.cos(far), 1.0)
+
+    def _cells(self, points):
+        y = points[:, 0] * METERS_PER_DEGREE
+        x = points[:, 1] * METERS_PER_DEGREE * np.cos(np.radians(self.lat0))
+        return np.floor(np.stack([y, x], axis=1) / self.cell_size).astype(np.int64)
+
+    def _keys(self, cells):
+        # cells outside the indexed area get keys no indexed point has
+        rel = cells - self._offset
+        inside = (rel[:, 1] >= 0) & (rel[:, 1] < self._width)
+        return np.where(inside, rel[:, 0] * self._width + rel[:, 1], -1)
+
+    def query(self, points, radius):
+        """
+        Find all indexed points within radius of the given points.
+
+        :param points: (k, 2) array of (lat, lon)
+        :param radius: in meters, a radius up to the cell size the index was built with only looks at the
+            3x3 cells around each point
+        :return: (rows, cols, distances) with rows indexing points, cols indexing the indexed points
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+        empty = np.empty(0, dtype=np.int64)
+        if not len(points) or not len(self.points):
+            return empty, empty, np.empty(0, dtype=np.float64)
+
+        # the tolerance keeps a radius equal to the one the index was built for at one ring
+        rings = max(int(np.ceil(radius * self._stretch(points) / self.cell_size - 1e-9)), 1)
+        if (2 * rings + 1) ** 2 >= len(self.points):
+            rows, cols = np.divmod(np.arange(len(points) * len(self.points)), len(self.points))
+        else:
+            cells = self._cells(points)
+            rows, cols = [], []
+            for dy in range(-rings, rings + 1):
+                for dx in range(-rings, rings + 1):
+                    keys = self._keys(cells + (dy, dx))
+                    lo = np.searchsorted(self._sorted_keys, keys, "left")
+                    hi = np.searchsorted(self._sorted_keys, keys, "right")
+                    counts = np.where(keys >= 0, hi - lo, 0)
+
+                    # expand every [lo, hi) range into the positions it covers
+                    total = counts.sum()
+                    starts = np.repeat(np.cumsum(counts) - counts, counts)
+                    positions = np.arange(total) - starts + np.repeat(lo, counts)
+
+                    rows.append(np.repeat(np.arange(len(points)), counts))
+                    cols.append(self._order[positions])
+            rows, cols = np.concatenate(rows), np.concatenate(cols)
+
+        dist = haversine(points[rows, 0], points[rows, 1], self.points[cols, 0], self.points[cols, 1])
+        keep = dist < radius
+
+        return rows[keep], cols[keep], dist[keep]
+
+
+def radius_pairs(src, dst, radius, index=None):
+    """
+    All (i, j) with distance(src[i], dst[j]) < radius, without computing the full matrix.
+
+    :param index: GridIndex over dst to reuse, built here if not given
+    :return: (rows, cols, distances)
+    """
+    dst = np.asarray(dst, dtype=np.float64).reshape(-1, 2)
+    src = np.asarray(src, dtype=np.float64).reshape(-1, 2)
+
+    if not np.isfinite(radius):
+        rows, cols = np.divmod(np.arange(len(src) * len(dst)), max(len(dst), 1))
+        return rows, cols, haversine(src[rows, 0], src[rows, 1], dst[cols, 0], dst[cols, 1])
+
+    if index is None:
+        index = GridIndex(dst, radius)
+
+    return index.query(src, radius)
+
+
+def nearest_pairs(src, dst, radius, index=None):
+    """
+    The nearest dst point of every src point, from radius queries that double the radius until every src
+    point has found one, so only the points with nothing close by look further.
+
+    :param radius: meters to start with
+    :param index: GridIndex over dst to reuse, built here if not given
+    :return: (rows, cols, distances), one pair per src point, none if dst is empty
+    """
+    dst = np.asarray(dst, dtype=np.float64).reshape(-1, 2)
+    src = np.asarray(src, dtype=np.float64).reshape(-1, 2)
+
+    rows_out, cols_out, dists_out = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0)]
+    todo = np.arange(len(src)) if len(dst) else np.empty(0, dtype=np.int64)
+    radius = max(float(radius), 1.0)
+    if index is None and len(todo):
+        index = GridIndex(dst, radius)
+    while len(todo):
+        rows, cols, dists = radius_pairs(src[todo], dst, radius, index)
+        order = np.lexsort((dists, rows))
+        rows, cols, dists = rows[order], cols[order], dists[order]
+        first = np.r_[True, rows[1:] != rows[:-1]] if len(rows) else np.empty(0, dtype=bool)
+
+        # everything within radius was returned, so the closest hit of a point is its nearest
+        rows_out.append(todo[rows[first]])
+        cols_out.append(cols[first])
+        dists_out.append(dists[first])
+        todo = np.delete(todo, rows[first])
+        radius *= 2
+
+    return np.concatenate(rows_out), np.concatenate(cols_out), np.concatenate(dists_out)
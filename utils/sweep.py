@@ -0,0 +1,155 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pyomo.environ as pyo
+from utils.distances import scenario_matrices
+from utils.evaluate import PlanEvaluator
+from utils.portfolio import ENGINES, complete_plan, run_engine
+from utils.utils import pool_context, random_scenario
+
+_scenario = None
+
+
+def _init_worker(scenario):
+    # the scenario and its matrices, forked workers inherit them once instead of receiving them with every size
+    global _scenario
+    _scenario = scenario
+
+
+def fleet_matrices(matrices, size):
+    # the matrices of the first size vehicles, the customer blocks are shared
+    return dict(matrices, vehicle_pickup=matrices["vehicle_pickup"][:size])
+
+
+def plan_fleet(size):
+    """
+    Plan the scenario of the worker with its first size vehicles, see run_engine.
+
+    :return: size, starts, connections, seconds spent
+    """
+    s = _scenario
+    starts, connections, seconds = run_engine(s["planner"], s["vehicles"][:size], s["customers"], s["radius"],
+                                              s["options"], s["time_budget"], s["formulation"],
+                                              fleet_matrices(s["matrices"], size), s["vehicle_radius"])
+    return size, starts, connections, seconds
+
+
+class FleetSweep:
+    """
+    Solve one scenario for different fleet sizes on a process pool.
+
+    The matrices and the PlanEvaluator are computed once for the whole fleet, a smaller fleet keeps the first
+    vehicles and only slices off the vehicle rows. Every size is planned with run_engine in a worker, completed
+    with complete_plan so every customer is served and scored offline.
+
+    :param planner: an engine of run_engine, "insertion" and "local_search" take a fraction of a second,
+        "milp" gets time_budget per fleet size
+    :param workers: processes, defaults to one per core, HiGHS threads are split between them. With "ortools"
+        the process must not have loaded highspy yet, see portfolio
+    """
+
+    def __init__(self, vehicles, customers, radius, opt, planner="local_search", time_budget=1.0,
+                 formulation="cuts", matrices=None, vehicle_radius=None, workers=None):
+        self.vehicles, self.customers = vehicles, customers
+        self.evaluator = PlanEvaluator(vehicles, customers)
+        self.workers = workers or os.cpu_count() or 1
+
+        options = dict(opt.options)
+        self.context, options["threads"] = pool_context(self.workers)
+        self.scenario = {
+            "vehicles": vehicles, "customers": customers, "radius": radius, "options": options, "planner": planner,
+            "time_budget": time_budget, "formulation": formulation, "vehicle_radius": vehicle_radius,
+            "matrices": matrices or scenario_matrices(vehicles, customers, dropoff_pickup=False),
+        }
+
+    def run(self, sizes):
+        """
+        Plan and score fleet sizes side by side.
+
+        :return: per size a dict with "vehicles" (the fleet size), "score" (PlanEvaluator's cumulative score,
+            waits from the start of the scenario), "reported_score" (calculate_score, waits from the assignment
+            like update_scenario reports them, barely depends on the fleet size), "max_wait" (seconds, from
+            the start of the scenario), "starts", "connections" and "seconds" spent planning
+        """
+        results = []
+        with ProcessPoolExecutor(min(self.workers, len(sizes)), self.context, _init_worker,
+                                 (self.scenario,)) as pool:
+            for size, starts, connections, seconds in pool.map(plan_fleet, sizes):
+                starts, connections = complete_plan(self.vehicles[:size], self.customers, starts, connections)
+                waits = self.evaluator.wait_times(starts, connections, cumulative=True)
+                results.append({"vehicles": size, "score": self.evaluator.score(starts, connections),
+                                "reported_score": self.evaluator.score(starts, connections, cumulative=False),
+                                "max_wait": max(waits.values(), default=0.0), "starts": starts,
+                                "connections": connections, "seconds": seconds})
+
+        return results
+
+    def sweep(self, smallest=1, max_score=None):
+        """
+        Solve for all N, N - 1, ... smallest vehicles, workers sizes at a time.
+
+        The scores can be passed to visualize_compare_cars(N, scores).
+
+        :param max_score: stop after the batch in which a fleet's cumulative score is above this
+        :return: the results of run, largest fleet first
+        """
+        results = []
+        sizes = list(range(len(self.vehicles), smallest - 1, -1))
+        for batch in range(0, len(sizes), self.workers):
+            results += self.run(sizes[batch:batch + self.workers])
+            if max_score is not None and any(r["score"] > max_score for r in results):
+                break
+
+        return results
+
+    def smallest_fleet(self, max_wait, verbose=False):
+        """
+        Search the smallest fleet whose customers all wait at most max_wait seconds from the start.
+
+        Assumes that fewer vehicles never wait less, which only holds approximately for heuristic plans. Every
+        round plans workers sizes spread over the open interval, so one worker is a binary search with
+        O(log N) solves and more workers shrink the interval faster.
+
+        :return: the result of run for that fleet, None if even all vehicles miss max_wait
+        """
+        # sizes up to low miss max_wait, high meets it, the first round also tries all vehicles
+        low, high, best = 0, len(self.vehicles) + 1, None
+        count = self.workers - 1
+        sizes = [len(self.vehicles)]
+        while True:
+            sizes = sorted(({low + (high - low) * (i + 1) // (count + 1) for i in range(count)} | set(sizes))
+                           - {low, high})
+            for r in self.run(sizes):
+                if r["max_wait"] <= max_wait and r["vehicles"] < high:
+                    high, best = r["vehicles"], r
+            low = max([low] + [size for size in sizes if size < high])
+            if verbose:
+                print(f"fleet sizes {sizes}: between {low} and {high} vehicles")
+
+            if best is None or high - low <= 1:
+                return best
+            count, sizes = min(self.workers, high - low - 1), []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve a random scenario for fewer and fewer vehicles.")
+    parser.add_argument("--vehicles", type=int, default=20)
+    parser.add_argument("--customers", type=int, default=80)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--planner", choices=ENGINES, default="local_search")
+    parser.add_argument("--time-budget", type=float, default=1.0, help="seconds per fleet size")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-wait", type=float, default=None,
+                        help="seconds, search the smallest fleet in which no customer waits longer instead")
+    args = parser.parse_args()
+
+    scenario = random_scenario(args.vehicles, args.customers, args.seed)
+    fleet_sweep = FleetSweep(scenario["vehicles"], scenario["customers"], 100, pyo.SolverFactory('appsi_highs'),
+                             args.planner, args.time_budget, workers=args.workers)
+    if args.max_wait is None:
+        for result in fleet_sweep.sweep():
+            print(f"{result['vehicles']} vehicles: score {result['score']:.0f} "
+                  f"(reported {result['reported_score']:.0f}), longest wait {result['max_wait']:.0f}s")
+    else:
+        result = fleet_sweep.smallest_fleet(args.max_wait, verbose=True)
+        print(f"smallest fleet: {result['vehicles']} vehicles" if result else "even all vehicles miss --max-wait")
@@ -1,10 +1,11 @@
-import orfuncs
+from utils import orfuncs
 
 
-def distance_optimize(vehicles, customers):
+def distance_optimize(vehicles, customers, matrices=None, initial_plan=None):
     # THIS IS THE OPTIMIZER
     # RESULT = dimensions(cars, assigned customers in the order of pick_up to this car)
-    result = orfuncs.solve(vehicles, customers)
+    # initial_plan: starts, connections of the last dispatch cycle or of schedule to continue from
+    result = orfuncs.solve(vehicles, customers, matrices, initial_plan=initial_plan)
 
     for rez in result:
         rez.pop(0)
@@ -1,10 +1,11 @@
+import heapq
 import math
-import json
-import time
-import requests
 import matplotlib.pyplot as plt
+import multiprocessing
+import os
 import pyomo.environ as pyo
 import random
+from utils.client import ScenarioClient, WallClock
 
 
 def calculate_remaining_travel_time(vehicle_coord_x, vehicle_coord_y, customer_coord_x, customer_coord_y, speed):
@@ -73,6 +74,45 @@ def randomized_payload(cars, customers):
     return payload
 
 
+def random_scenario(amount_v, amount_c, seed=None):
+    # offline stand-in for scenario/create, same json layout, coordinates inside the Munich area of the simulation
+    rng = random.Random(seed)
+
+    def point():
+        return rng.uniform(48.113, 48.165), rng.uniform(11.503, 11.646)
+
+    customers = []
+    for i in range(amount_c):
+        (x, y), (dx, dy) = point(), point()
+        customers.append({"id": f"c{i:05d}", "coordX": x, "coordY": y, "destinationX": dx, "destinationY": dy,
+                          "awaitingService": True})
+
+    vehicles = []
+    for i in range(amount_v):
+        x, y = point()
+        vehicles.append({"id": f"v{i:05d}", "coordX": x, "coordY": y})
+
+    return {"id": f"random-{seed}", "customers": customers, "vehicles": vehicles}
+
+
+def pool_context(workers, solvers=None):
+    """
+    Start method and HiGHS threads for a process pool, the cores are split so the workers do not
+    oversubscribe them.
+
+    :param workers: processes of the pool
+    :param solvers: how many of them run HiGHS, defaults to all, the others take one core each
+    :return: multiprocessing context, HiGHS threads per solving worker
+    """
+    cores = os.cpu_count() or 1
+    solvers = workers if solvers is None else solvers
+    threads = max(1, (cores - workers + solvers) // max(solvers, 1))
+
+    # forked workers do not import main again, which runs a scenario at import
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("fork" if "fork" in methods else None), threads
+
+
 def visualize_compare_cars(len_cars, results):
     #for now: one car more for every result
     #results go from smallest car setup to highest car setup
@@ -117,120 +157,158 @@ def plot_distance_distribution(model):
     plt.grid(axis="y", linestyle="--", alpha=0.7)
     plt.show()
     
-def update_scenario(starts, connections, scenario_id, speed):
+class FleetDispatch:
+    """
+    Queue-following state of one fleet, without any I/O, so a blocking and an asyncio loop can drive it.
+
+    ETAs live in a heap, in simulation seconds since the fleet started (a simulation second takes speed
+    seconds on clock). Every event instant the driver pops the vehicles that are due, refreshes the id -> vehicle
+    mirror with a single get_scenario, and sends the assignments for the free ones in one multi-vehicle
+    update. A vehicle that is still driving, e.g. to the dropoff, goes back on the heap with the remaining
+    time the scenario reports.
+    """
+
+    def __init__(self, speed, queues, verbose=False, clock=WallClock):
+        """
+        :param queues: vehicle id -> customers still to serve after the current one, consumed
+        :param clock: client.clock(scenario_id), real time for the services, virtual for the Simulator
+        """
+        self.speed = speed
+        self.queues = queues
+        self.verbose = verbose
+        self.clock = clock
+        self.start = clock.monotonic()
+        self.events = []
+        self.vehicles = {}
+        self.wait_times = {}  # customer id -> remainingTravelTime reported when it was assigned
+
+    def now(self):
+        return (self.clock.monotonic() - self.start) / self.speed
+
+    def delay(self):
+        # wall seconds until the next vehicle is due
+        return max((self.events[0][0] - self.now()) * self.speed, 0)
+
+    def dispatched(self, updated):
+        # updatedVehicles of an update_scenario answer
+        for v in updated:
+            if self.verbose:
+                print(f"{v["id"][:6]} --> {v["customerId"][:6]} (ETA: {v["remainingTravelTime"]}s)")
+            self.vehicles.setdefault(v["id"], {}).update(v)
+            self.wait_times[v["customerId"]] = v["remainingTravelTime"]
+            heapq.heappush(self.events, (self.now() + v["remainingTravelTime"], v["id"]))
+
+    def arrived(self):
+        # pop every vehicle due by now, a virtual clock can land a rounding error short of the ETA it slept to
+        self.instant = self.now()
+        arrived = []
+        while self.events and self.events[0][0] <= self.instant + 1e-6:
+            arrived.append(heapq.heappop(self.events)[1])
+
+        return arrived
+
+    def assignments(self, arrived, scenario_vehicles):
+        """
+        :param scenario_vehicles: "vehicles" of a get_scenario answer taken after arrived()
+        :return: next customer for every arrived vehicle that is free and has one left
+        """
+        for v in scenario_vehicles:
+            self.vehicles[v["id"]] = v
+
+        assignments = []
+        for vehicle_id in arrived:
+            remaining = self.vehicles[vehicle_id]["remainingTravelTime"]
+            if remaining:
+                heapq.heappush(self.events, (self.instant + remaining, vehicle_id))
+            elif self.queues.get(vehicle_id):
+                assignments.append({"id": vehicle_id, "customerId": self.queues[vehicle_id].pop(0)})
+            elif self.verbose:
+                print(f"Finished: {vehicle_id[:6]}")
+
+        if assignments and self.verbose:
+            print("Updated vehicles (Vehicle -> Customer):")
+
+        return assignments
+
+
+def dispatch_queues(client, scenario_id, speed, updated_vehicles, queues, verbose=False):
+    """
+    Drive every vehicle through its queue with a FleetDispatch, sleeping straight to the next arrival.
+
+    That is two calls per event instant, however many vehicles arrive in it, see dispatch_fleets in
+    utils.fleet for several scenarios at once.
+
+    :param client: ScenarioClient or Simulator
+    :param updated_vehicles: "updatedVehicles" of the update that started the vehicles
+    :param queues: vehicle id -> customers still to serve after the current one, consumed
+    :return: dict customer id -> remainingTravelTime reported when the customer was assigned
+    """
+    clock = client.clock(scenario_id)
+    fleet = FleetDispatch(speed, queues, verbose, clock)
+    fleet.dispatched(updated_vehicles)
+
+    while fleet.events:
+        clock.sleep(fleet.delay())
+
+        arrived = fleet.arrived()
+        assignments = fleet.assignments(arrived, client.get_scenario(scenario_id)["vehicles"])
+        if assignments:
+            fleet.dispatched(client.update_scenario(scenario_id, assignments)["updatedVehicles"])
+
+    return fleet.wait_times
+
+
+def plan_queues(starts, connections):
+    """
+    Follow the connections from every start.
+
+    :return: dict vehicle id -> the customers it serves after its first one, vehicles without any are left out
+    """
+    successor = dict(connections)
+
+    queues = {}
+    for vehicle, customer in starts:
+        queue = []
+        while customer in successor and successor[customer] not in queue:
+            customer = successor[customer]
+            queue.append(customer)
+        if queue:
+            queues[vehicle] = queue
+
+    return queues
+
+
+def update_scenario(starts, connections, scenario_id, speed, client=None, verbose=True):
+    client = client or ScenarioClient()
+
     # update scenario
-    print("Starting Simulation...")
-    payload = {"vehicles":[{"id":x, "customerId":y} for (x,y) in starts]}
-    payload_json = json.dumps(payload)
-    r = requests.put(f"http://localhost:8090/Scenarios/update_scenario/{scenario_id}", json=json.loads(payload_json))
-    r_json = json.loads(r.content.decode())        
-
-    # first, for each customer, find them as the first element in a tuple in "connections"
-    # this counts as a queue, and the driver responsible will go through the queue until finished
-    # if no one follows in the queue, we're done
+    if verbose:
+        print("Starting Simulation...")
+    r_json = client.update_scenario(scenario_id, [{"id":x, "customerId":y} for (x,y) in starts])
+
+    # each vehicle goes through the chain of connections behind its first customer until it is finished
     updated_vehicles = r_json["updatedVehicles"]
     
-    print("Updated vehicles (Vehicle -> Customer):")
-    for v in updated_vehicles:
-        print(f"{v["id"][:6]} --> {v["customerId"][:6]} (ETA: {v["remainingTravelTime"]}s)")
-    
-    updated_vehicles_times = [{v["id"]: v["remainingTravelTime"]} for v in updated_vehicles]
-    queues = {} # this will contain the remaining vehicle paths...
-    time_elapsed = 0
-    wait_times = [{v["customerId"]: v["remainingTravelTime"]} for v in updated_vehicles]
-    for (vehicle, customer) in starts:
-        queues[vehicle] = [customer]
-        i = 0
-        while i < len(connections):
-            if connections[i][0] == customer:
-                queues[vehicle].append(connections[i][1])
-                customer = connections[i][1]
-                i = 0
-            else:
-                i += 1
-        if len(queues[vehicle]) == 1:
-            del queues[vehicle]
-        else:
-            queues[vehicle] = queues[vehicle][1:]
-                
-    # decrement timers; as soon as one hits 0, see which and update status accordingly
-    while True:
-        # decrement all...
-        for vehicle_time in updated_vehicles_times:
-            for vehicle_id, remaining_time in vehicle_time.items():
-                if remaining_time > 0:
-                    vehicle_time[vehicle_id] -= 1
-        
-        # ... then check if one of them became 0
-        # if so, see if the ID which is done has anything left in the queue
-        # if not, remove it
-        # if it does, dispatch next customer
-        for vehicle_time in updated_vehicles_times:
-            for vehicle_id, remaining_time in vehicle_time.items():
-                if remaining_time == 0:
-                    # get time to see if anything changed
-                    r = requests.get(f"http://localhost:8090/Scenarios/get_scenario/{scenario_id}")
-                    r_json = json.loads(r.content.decode())
-                    r_vehicles = r_json["vehicles"]
-                    for r_v in r_vehicles:
-                        if r_v["id"] == vehicle_id:
-                            if r_v["remainingTravelTime"] is not None:
-                                vehicle_time[vehicle_id] += r_v["remainingTravelTime"]
-                                # print(f"{vehicle_id[:6]} with {r_v["customerId"][:6]} arrived, new ETA: {vehicle_time[vehicle_id]}s")
-                                break
-                        
-                    if vehicle_time[vehicle_id] != 0:
-                        break
-                    
-                    if not vehicle_id in queues or not queues[vehicle_id]:
-                        print(f"Finished: {vehicle_id[:6]}")
-                        updated_vehicles_times.remove(vehicle_time)
-                    else:
-                        next_customer = queues[vehicle_id][0]
-                        
-                        payload = {"vehicles":[{"id":vehicle_id, "customerId":next_customer}]}
-                        payload_json = json.dumps(payload)
-                        
-                        r = requests.put(f"http://localhost:8090/Scenarios/update_scenario/{scenario_id}", json=json.loads(payload_json))
-                        r_json = json.loads(r.content.decode())     
-                        
-                        new_updated = r_json["updatedVehicles"]
-                        
-                        print("Updated vehicles (Vehicle -> Customer):")
-                        for v in new_updated:
-                            print(f"{v["id"][:6]} --> {v["customerId"][:6]} (ETA: {v["remainingTravelTime"]}s)")
-                        
-                        new_wait_times = [{v["customerId"]: v["remainingTravelTime"]} for v in new_updated]
-                        for item in new_wait_times:
-                            for _, val in item.items():
-                                val += time_elapsed
-                        wait_times = wait_times + new_wait_times
-                        
-                        
-                        queues[vehicle_id] = queues[vehicle_id][1:]
-                    break
-
-        if not updated_vehicles_times:
-            break
-        
-        #print(updated_vehicles_times)
-        time_elapsed += 1
-        time.sleep(speed * 1.5) # safety net
-
-        result = {}
-        for dict in wait_times:
-            for id, t in dict.items():
-                result[id] = t
+    if verbose:
+        print("Updated vehicles (Vehicle -> Customer):")
+
+    queues = plan_queues(starts, connections)
+
+    result = dispatch_queues(client, scenario_id, speed, updated_vehicles, queues, verbose)
     
-    print()
-    print("Done (Customer, Total Wait Time):")
-    for x in result.items():
-        print(x)
+    if verbose:
+        print()
+        print("Done (Customer, Total Wait Time):")
+        for x in result.items():
+            print(x)
     return result
 
-def update_scenario_dist(payload, scenario_id, speed):
+def update_scenario_dist(payload, scenario_id, speed, client=None, verbose=True):
+    client = client or ScenarioClient()
+
     # build queues
-    print("start simulation")
+    if verbose:
+        print("start simulation")
     vehicles = payload["vehicles"]
     seen_ids = set()
     filtered_list = []
@@ -248,17 +326,10 @@ def update_scenario_dist(payload, scenario_id, speed):
     #print("Queue:", queue)
     #print()
     
-    actual_payload = {"vehicles": filtered_list}
-    
     # update scenario
-    payload_json = json.dumps(actual_payload)
-    r = requests.put(f"http://localhost:8090/Scenarios/update_scenario/{scenario_id}", json=json.loads(payload_json))
-    r_json = json.loads(r.content.decode())
+    r_json = client.update_scenario(scenario_id, filtered_list)
 
     updated_vehicles = r_json["updatedVehicles"]
-    updated_vehicles_times = [{v["id"]: v["remainingTravelTime"]} for v in updated_vehicles]
-    time_elapsed = 0
-    wait_times = [{v["customerId"]: v["remainingTravelTime"]} for v in updated_vehicles]
     
     queues = {}
 
@@ -266,70 +337,9 @@ def update_scenario_dist(payload, scenario_id, speed):
         if entry['id'] not in queues:
             queues[entry['id']] = []
         queues[entry['id']].append(entry['customerId'])
-    
-    #print(updated_vehicles_times)
-    #print()
-    #print(wait_times)
-    
-    while True:
-        # decrement all...
-        for vehicle_time in updated_vehicles_times:
-            for vehicle_id, remaining_time in vehicle_time.items():
-                if remaining_time > 0:
-                    vehicle_time[vehicle_id] -= 1
-        
-        # ... then check if one of them became 0
-        # if so, see if the ID which is done has anything left in the queue
-        # if not, remove it
-        # if it does, dispatch next customer
-        for vehicle_time in updated_vehicles_times:
-            for vehicle_id, remaining_time in vehicle_time.items():
-                if remaining_time == 0:
-                    # get time to see if anything changed
-                    r = requests.get(f"http://localhost:8090/Scenarios/get_scenario/{scenario_id}")
-                    r_json = json.loads(r.content.decode())
-                    r_vehicles = r_json["vehicles"]
-                    for r_v in r_vehicles:
-                        if r_v["id"] == vehicle_id:
-                            if r_v["remainingTravelTime"] is not None:
-                                vehicle_time[vehicle_id] += r_v["remainingTravelTime"]
-                                break
-                        
-                    if vehicle_time[vehicle_id] != 0:
-                        break
-                    
-                    if not vehicle_id in queues or not queues[vehicle_id]:
-                        updated_vehicles_times.remove(vehicle_time)
-                    else:
-                        next_customer = queues[vehicle_id][0]
-                        
-                        payload = {"vehicles":[{"id":vehicle_id, "customerId":next_customer}]}
-                        payload_json = json.dumps(payload)
-                        
-                        r = requests.put(f"http://localhost:8090/Scenarios/update_scenario/{scenario_id}", json=json.loads(payload_json))
-                        r_json = json.loads(r.content.decode())     
-                        
-                        new_updated = r_json["updatedVehicles"]
-                        new_wait_times = [{v["customerId"]: v["remainingTravelTime"]} for v in new_updated]
-                        for item in new_wait_times:
-                            for _, val in item.items():
-                                val += time_elapsed
-                        wait_times = wait_times + new_wait_times
-                        
-                        
-                        queues[vehicle_id] = queues[vehicle_id][1:]
-                    break
-
-        if not updated_vehicles_times:
-            break
-
-        time_elapsed += 1
-        time.sleep(speed * 1.5) # safety net
-
-    result = {}
-    for dict in wait_times:
-        for id, t in dict.items():
-            result[id] = t
-
-    print("done")
+
+    result = dispatch_queues(client, scenario_id, speed, updated_vehicles, queues)
+
+    if verbose:
+        print("done")
     return result